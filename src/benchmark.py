@@ -0,0 +1,185 @@
+#src/benchmark.py
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+from src import monitor, shards, storage
+from src.main import register_directory
+
+#file size distributions for generated trees: (min bytes, max bytes, share of files)
+SIZE_DISTRIBUTIONS = {
+    "small": [(0, 4 * 1024, 1.0)],
+    "mixed": [(0, 4 * 1024, 0.80), (4 * 1024, 256 * 1024, 0.18), (256 * 1024, 8 * 1024 * 1024, 0.02)],
+    "large": [(1024 * 1024, 64 * 1024 * 1024, 1.0)],
+}
+
+#a result is a regression when it is this much slower than the baseline
+DEFAULT_TOLERANCE = 0.25
+
+
+def generate_tree(root: Path, files: int, sizes: str = "mixed", depth: int = 3, fanout: int = 10,
+                  seed: int = 0) -> List[Path]:
+    """Create a synthetic tree of files spread over directories depth levels deep."""
+    rng = random.Random(seed)
+    distribution = SIZE_DISTRIBUTIONS[sizes]
+    block = os.urandom(1024 * 1024)
+
+    #directories at the deepest level, files are spread evenly over them
+    dirs = [root]
+    for _ in range(depth):
+        dirs = [d / f"d{i}" for d in dirs for i in range(fanout)]
+        if len(dirs) >= files:
+            break
+    for d in dirs:
+        d.mkdir(parents=True, exist_ok=True)
+
+    paths = []
+    for i in range(files):
+        low, high, _ = rng.choices(distribution, weights=[share for _, _, share in distribution])[0]
+        size = rng.randint(low, high)
+        path = dirs[i % len(dirs)] / f"f{i}.bin"
+        with path.open("wb") as f:
+            while size > 0:
+                offset = rng.randrange(len(block))
+                chunk = block[offset:offset + size]
+                f.write(chunk)
+                size -= len(chunk)
+        paths.append(path)
+    return paths
+
+def mutate_tree(paths: List[Path], rate: float, seed: int = 1) -> List[Path]:
+    """Append to a share of the files (rate between 0 and 1) and return the ones that changed."""
+    rng = random.Random(seed)
+    changed = rng.sample(paths, int(len(paths) * rate))
+    for path in changed:
+        with path.open("ab") as f:
+            f.write(b"mutated")
+    return changed
+
+
+def timed(func: Callable[[], object], repeat: int = 1) -> float:
+    """Return the best wall time of func over repeat runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run_benchmarks(files: int, sizes: str, depth: int, mutation_rate: float, workdir: Path) -> Dict[str, Dict]:
+    """Time the key operations on a generated tree of the given size."""
+    results: Dict[str, Dict] = {}
+    tree = workdir / "tree"
+    data = workdir / "data"
+    data.mkdir()
+
+    def record(name: str, seconds: float, count: int, nbytes: int | None = None) -> None:
+        result = {"seconds": round(seconds, 6), "count": count, "per_sec": round(count / seconds, 2) if seconds else None}
+        if nbytes is not None:
+            result["mb_per_sec"] = round(nbytes / seconds / 1e6, 2) if seconds else None
+        results[f"{name}[{files}]"] = result
+
+    paths = generate_tree(tree, files, sizes, depth)
+    total_bytes = sum(p.stat().st_size for p in paths)
+    results[f"tree[{files}]"] = {"files": files, "bytes": total_bytes}
+
+    #metadata without hashing (previous record with a matching fingerprint) and hashing throughput
+    infos = [monitor.get_file_metadata(p) for p in paths]
+    record("get_file_metadata", timed(lambda: [monitor.get_file_metadata(p, None, i) for p, i in zip(paths, infos)]), files)
+    record("calculate_hash", timed(lambda: [monitor.calculate_hash(p) for p in paths]), files, total_bytes)
+
+    #scans: cold (everything rehashed), warm (nothing changed), and after mutating part of the tree
+    record("scan_once_cold", timed(lambda: monitor.scan_once(infos, full_rehash=True)), files, total_bytes)
+    record("scan_once_warm", timed(lambda: monitor.scan_once(infos), repeat=3), files)
+    record("scan_sharded_warm", timed(lambda: shards.scan_sharded(infos), repeat=3), files)
+    changed = mutate_tree(paths, mutation_rate)
+    record("scan_once_mutated", timed(lambda: monitor.scan_once(infos)), files)
+    results[f"scan_once_mutated[{files}]"]["changed"] = len(changed)
+
+    #storage round trips for every backend
+    for name, backend in (("json", storage.JsonBackend(data / "files.json")),
+                          ("sqlite", storage.SqliteBackend(data / "files.db", None))):
+        record(f"save_files_{name}", timed(lambda: backend.save_files(infos)), files)
+        record(f"load_files_{name}", timed(backend.load_files, repeat=3), files)
+
+    #directory registration into an empty store
+    storage.set_backend(storage.SqliteBackend(data / "register.db", None))
+    try:
+        record("add_monitored_directory", timed(lambda: register_directory(tree, True, show_progress=False)), files, total_bytes)
+    finally:
+        storage.set_backend(None)
+    return results
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Return a line for every result slower than its baseline by more than tolerance."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or not base.get("seconds"):
+            continue
+        ratio = result["seconds"] / base["seconds"]
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: {result['seconds']:.4f}s vs baseline {base['seconds']:.4f}s ({ratio:.2f}x)")
+    return regressions
+
+
+def main() -> int:
+    """Run the benchmarks from the command line and write the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark the scan, hash and storage paths on synthetic trees.")
+    parser.add_argument("--files", default="1000", help="comma separated tree sizes, e.g. 1000,100000,1000000")
+    parser.add_argument("--sizes", default="mixed", choices=sorted(SIZE_DISTRIBUTIONS))
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--mutation-rate", type=float, default=0.01)
+    parser.add_argument("--output", help="write the results to this JSON file (default stdout)")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    results: Dict[str, Dict] = {}
+    for files in (int(n) for n in args.files.split(",")):
+        workdir = Path(tempfile.mkdtemp(prefix="file-monitor-bench-"))
+        try:
+            results.update(run_benchmarks(files, args.sizes, args.depth, args.mutation_rate, workdir))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "hash_algorithm": monitor.HASH_ALGORITHM,
+            "hash_workers": monitor.HASH_WORKERS,
+            "sizes": args.sizes,
+            "depth": args.depth,
+            "mutation_rate": args.mutation_rate,
+            "time": time.time(),
+        },
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+    #gate against a stored baseline: non-zero exit status on regressions
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
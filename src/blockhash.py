@@ -0,0 +1,233 @@
+#src/blockhash.py
+from __future__ import annotations
+import hashlib
+import logging
+import os
+import random
+import time
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Tuple
+from src.throttle import IOBudget
+from src.utils import advise
+
+logger = logging.getLogger(__name__)
+
+#files of at least BLOCK_HASH_MIN_SIZE bytes get a Merkle tree over fixed-size blocks instead of one digest
+#(0 disables block hashing). the record's hash_value is then the root of the tree and its hash_algorithm
+#is marked with MERKLE_PREFIX (merkle-sha256), so a root is never mistaken for the digest of the whole file
+BLOCK_HASH_MIN_SIZE: int = 256 * 1024 * 1024
+MERKLE_PREFIX = "merkle-"
+
+#block size of new trees: BLOCK_SIZE, doubled until the file has at most MAX_BLOCKS blocks.
+#a tree keeps its block size afterwards so the blocks of two versions line up
+BLOCK_SIZE: int = 4 * 1024 * 1024
+MAX_BLOCKS: int = 4096
+
+#when a file grew, this many random earlier blocks are verified along with the last one before
+#only the new tail is hashed. an unchanged file gets this many random blocks verified now and then
+#between its full verifications (the full paranoid rehash still verifies every block)
+SAMPLE_BLOCKS: int = 2
+
+#an unchanged file is sampled at most once every SAMPLE_INTERVAL seconds (the time of the last check is kept in its tree)
+SAMPLE_INTERVAL: float = 60 * 60
+
+#read size inside a block
+_READ_SIZE = 1024 * 1024
+
+
+class BlockUpdate:
+    """Result of hashing a block-hashed file: the new tree, its roots and what changed."""
+
+    __slots__ = ("tree", "roots", "appended", "changed", "bytes_read")
+
+    def __init__(self, tree: Dict, roots: Dict[str, str], appended: Tuple[int, int] | None,
+                 changed: List[List[int]], bytes_read: int) -> None:
+        self.tree = tree
+        self.roots = roots
+        #(old size, new size) when the file only grew
+        self.appended = appended
+        #[start, end) byte ranges whose content changed (a shrink shows up as the range that was cut off)
+        self.changed = changed
+        self.bytes_read = bytes_read
+
+
+def uses_blocks(size: int) -> bool:
+    """Check if a file of this size is block-hashed."""
+    return BLOCK_HASH_MIN_SIZE > 0 and size >= BLOCK_HASH_MIN_SIZE
+
+def samples(tree: Dict | None, now: float) -> bool:
+    """Check if an unchanged file with this stored tree is due for a sample of its blocks to be verified."""
+    return SAMPLE_BLOCKS > 0 and tree is not None and bool(tree["blocks"]) \
+        and now - tree.get("checked", 0.0) >= SAMPLE_INTERVAL
+
+def merkle_algorithm(algorithm: str) -> str:
+    """hash_algorithm of a record whose hash value is the root of a tree hashed with algorithm."""
+    return MERKLE_PREFIX + algorithm
+
+def is_merkle(hash_algorithm: str) -> bool:
+    """Check if a record's hash_algorithm is a Merkle root."""
+    return hash_algorithm.startswith(MERKLE_PREFIX)
+
+def block_size_for(size: int) -> int:
+    """Pick the block size of a new tree."""
+    block_size = BLOCK_SIZE
+    while size > block_size * MAX_BLOCKS:
+        block_size *= 2
+    return block_size
+
+def merkle_root(blocks: List[str], algorithm: str, size: int) -> str:
+    """Root of the binary Merkle tree over the block digests (the file size is part of the root)."""
+    level = [bytes.fromhex(block) for block in blocks]
+    while len(level) > 1:
+        level = [hashlib.new(algorithm, b"".join(level[i:i + 2])).digest() for i in range(0, len(level), 2)]
+    return hashlib.new(algorithm, size.to_bytes(8, "big") + (level[0] if level else b"")).hexdigest()
+
+def _merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    """Merge adjacent [start, end) ranges."""
+    merged: List[List[int]] = []
+    for start, end in ranges:
+        if merged and merged[-1][1] == start:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _hash_blocks(f: BinaryIO, start: int, end: int, block_size: int, algorithms: List[str],
+                 budget: IOBudget | None, whole: List | None = None) -> Dict[str, List[str]]:
+    """Hash the blocks between start (a block boundary) and end with every algorithm.
+
+    The hash objects in whole are fed everything that is read (digests of the whole range).
+    """
+    digests: Dict[str, List[str]] = {algorithm: [] for algorithm in algorithms}
+    buffer = memoryview(bytearray(min(_READ_SIZE, block_size)))
+    f.seek(start)
+    for block_start in range(start, end, block_size):
+        hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+        remaining = min(block_size, end - block_start)
+        while remaining:
+            n = f.readinto(buffer[:min(len(buffer), remaining)])
+            if not n:
+                break
+            for h in hashes:
+                h.update(buffer[:n])
+            for h in whole or ():
+                h.update(buffer[:n])
+            if budget is not None:
+                budget.read(n)
+            remaining -= n
+        for algorithm, h in zip(algorithms, hashes):
+            digests[algorithm].append(h.hexdigest())
+    return digests
+
+def update_tree(path: Path, tree: Dict | None, algorithms: List[str], full: bool = False,
+                budget: IOBudget | None = None, drop_cache: bool = False, sample: bool = False) -> BlockUpdate | None:
+    """Bring the block tree of a file up to date, reading as little as possible.
+
+    algorithms are record hash algorithms. The first Merkle one is the algorithm of the new tree, a second one is
+    the algorithm the stored tree was built with (the roots of both are returned). Plain algorithms are the digest
+    of a baseline stored before the file was block-hashed: without a stored tree they are computed in the same read.
+    When the file grew and its last stored block and a sample of earlier blocks still match, only the tail is hashed.
+    With sample (the file did not change since its tree was stored) only a sample of blocks is verified.
+    Otherwise (or with full, or when a verified block differs) every block is hashed and compared.
+    Returns None when the file cannot be read.
+    """
+    try:
+        if budget is not None:
+            budget.open_file()
+
+        with path.open("rb", buffering=0) as f:
+            try:
+                return _update(f, tree, algorithms, full, sample, budget)
+            finally:
+                #do not leave the file in the page cache
+                if drop_cache:
+                    advise(f.fileno(), 0, 0, "DONTNEED")
+    except PermissionError:
+        logger.error(f"Permission denied when accessing file {path} for hashing.")
+        return None
+    except OSError as e:
+        #deleted or replaced since it was listed, or a read error: reported as missing or unreadable
+        logger.warning(f"Cannot read file {path} for hashing: {e}")
+        return None
+
+def _verify(f: BinaryIO, tree: Dict, checks: List[int], budget: IOBudget | None) -> Tuple[bool, int]:
+    """Hash the stored blocks in checks again. Returns whether they all match and the bytes read."""
+    block_size = tree["block_size"]
+    algorithm = tree["algorithm"]
+    bytes_read = 0
+    for i in checks:
+        end = min((i + 1) * block_size, tree["size"])
+        bytes_read += end - i * block_size
+        if _hash_blocks(f, i * block_size, end, block_size, [algorithm], budget)[algorithm][0] != tree["blocks"][i]:
+            return False, bytes_read
+    return True, bytes_read
+
+def _update(f: BinaryIO, tree: Dict | None, algorithms: List[str], full: bool, sample: bool,
+            budget: IOBudget | None) -> BlockUpdate:
+    """update_tree on an open file."""
+    flat = [name for name in algorithms if not is_merkle(name)]
+    algorithms = [name[len(MERKLE_PREFIX):] for name in algorithms if is_merkle(name)]
+    algorithm = algorithms[0]
+    size = os.fstat(f.fileno()).st_size
+
+    if tree is None or not tree["blocks"]:
+        #an old flat digest is hashed in the same read, so the first tree can still be compared with it
+        whole = {name: hashlib.new(name) for name in flat}
+        block_size = block_size_for(size)
+        blocks = _hash_blocks(f, 0, size, block_size, algorithms, budget, list(whole.values()))
+        update = _finish(BlockUpdate(None, {}, None, [], size), blocks, algorithm, block_size, size)
+        update.roots.update((name, h.hexdigest()) for name, h in whole.items())
+        return update
+
+    block_size = tree["block_size"]
+    old_size = tree["size"]
+    old = tree["blocks"]
+    last = len(old) - 1
+    bytes_read = 0
+
+    #unchanged since the tree was stored: verify a few random blocks (a change to an unsampled block
+    #is caught by a later sample or the next full pass)
+    if not full and sample and size == old_size and tree["algorithm"] == algorithm:
+        verified, bytes_read = _verify(f, tree, random.sample(range(len(old)), min(SAMPLE_BLOCKS, len(old))), budget)
+        if verified:
+            return _finish(BlockUpdate(None, {}, None, [], bytes_read), {algorithm: old}, algorithm, block_size, size)
+
+    #the file grew: verify the last stored block and a few random earlier ones, then hash only from the last block on.
+    #(a change to an unsampled block at the same time is caught by the next full pass)
+    if not full and size > old_size and tree["algorithm"] == algorithm:
+        verified, bytes_read = _verify(f, tree, [last] + random.sample(range(last), min(SAMPLE_BLOCKS, last)), budget)
+        if verified:
+            tail = _hash_blocks(f, last * block_size, size, block_size, [algorithm], budget)
+            bytes_read += size - last * block_size
+            blocks = {algorithm: old[:last] + tail[algorithm]}
+            update = BlockUpdate(None, {}, (old_size, size), [], bytes_read)
+            return _finish(update, blocks, algorithm, block_size, size)
+
+    #full pass: hash every block, in the stored tree's algorithm as well to compare with it
+    compare_with = tree["algorithm"]
+    if compare_with not in algorithms:
+        algorithms = algorithms + [compare_with]
+    blocks = _hash_blocks(f, 0, size, block_size, algorithms, budget)
+    bytes_read += size
+    current = list(blocks[compare_with])
+
+    #the old last block may have been partial: hash the same range of the current file to compare it
+    if size > old_size and old_size % block_size:
+        current[last] = _hash_blocks(f, last * block_size, old_size, block_size, [compare_with], budget)[compare_with][0]
+        bytes_read += old_size - last * block_size
+
+    changed = [[i * block_size, min((i + 1) * block_size, old_size, size)]
+               for i in range(min(len(old), len(current))) if old[i] != current[i]]
+    if size < old_size:
+        changed.append([size, old_size])
+    appended = (old_size, size) if size > old_size and not changed else None
+    update = BlockUpdate(None, {}, appended, _merge_ranges(changed), bytes_read)
+    return _finish(update, blocks, algorithm, block_size, size)
+
+def _finish(update: BlockUpdate, blocks: Dict[str, List[str]], algorithm: str, block_size: int, size: int) -> BlockUpdate:
+    """Fill in the new tree and the roots of every algorithm that was hashed (keyed by record hash algorithm)."""
+    update.tree = {"algorithm": algorithm, "block_size": block_size, "size": size, "blocks": blocks[algorithm],
+                   "checked": time.time()}
+    update.roots = {merkle_algorithm(name): merkle_root(digests, name, size) for name, digests in blocks.items()}
+    return update
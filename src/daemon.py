@@ -0,0 +1,330 @@
+#src/daemon.py
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, List
+from src.events import Event
+from src.records import FileRecord
+from src.metrics import ScanStats, record_scan
+from src.monitor import get_file_metadata, collect_metadata, scan_roots
+from src.shards import scan_files
+from src.storage import load_files, save_files, add_files, remove_file, remove_subtree, load_roots, save_roots, PathIndex
+from src.utils import setup_logging, normalize_path, walk_files, WALK_WORKERS
+
+logger = logging.getLogger(__name__)
+
+#local socket the daemon listens on (only the owner can connect)
+SOCKET_PATH = Path("data") / "file_monitor.sock"
+
+#how many recent events are kept in memory for the "events" command
+RECENT_EVENTS = 1000
+
+#how many events may wait for a slow "events" stream client before it is disconnected
+SUBSCRIBER_QUEUE_SIZE = 10000
+
+
+class MonitorDaemon:
+    """Keeps the monitored files and baselines in memory, scans them continuously and answers queries."""
+
+    def __init__(self, interval: float = 5.0) -> None:
+        self.interval = interval
+        self.files = load_files()
+        self.roots = load_roots()
+        self.by_path: Dict[str, FileRecord] = {f.path: f for f in self.files}
+        self.index = PathIndex(self.by_path)
+
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self.recent: deque = deque(maxlen=RECENT_EVENTS)
+        self._subscribers: List[queue.Queue] = []
+        self.last_scan = 0.0
+
+    def _publish(self, events: List[Event]) -> None:
+        """Keep the events for queries and hand them to every streaming client."""
+        for event in events:
+            data = event.to_dict()
+            self.recent.append(data)
+            for subscriber in list(self._subscribers):
+                try:
+                    subscriber.put_nowait(data)
+                except queue.Full:
+                    #drop clients that do not keep up instead of blocking the scan
+                    self.unsubscribe(subscriber)
+
+    def subscribe(self) -> queue.Queue:
+        subscriber: queue.Queue = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue) -> None:
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+
+            #wake the streaming thread up (making room if the queue is full)
+            while True:
+                try:
+                    subscriber.put_nowait(None)
+                    break
+                except queue.Full:
+                    subscriber.get_nowait()
+
+    def scan(self) -> List[Event]:
+        """Run one scan pass over the in-memory baseline and write back what changed."""
+        with self._lock:
+            scan_stats = ScanStats()
+            count = len(self.files)
+            with scan_stats.phase("roots"):
+                events = scan_roots(self.roots, self.files)
+            scan_stats.count_events(events)
+            for file_info in self.files[count:]:
+                self.by_path[file_info.path] = file_info
+                self.index.add(file_info.path)
+            events += scan_files(self.files, scan_stats=scan_stats)
+            with scan_stats.phase("save"):
+                save_files(self.files)
+                if self.roots:
+                    save_roots(self.roots)
+            record_scan(scan_stats)
+            self.last_scan = time.time()
+
+        self._publish(events)
+        return events
+
+    def add(self, path: Path, recursive: bool = False) -> int:
+        """Start monitoring a file, or every file of a directory. Returns how many files were added."""
+        if path.is_dir():
+            infos = list(collect_metadata(walk_files(path, recursive, workers=WALK_WORKERS)))
+        else:
+            infos = [get_file_metadata(path)]
+
+        with self._lock:
+            infos = [info for info in infos if info.path not in self.by_path]
+            for info in infos:
+                self.files.append(info)
+                self.by_path[info.path] = info
+                self.index.add(info.path)
+            add_files(infos)
+        return len(infos)
+
+    def remove(self, path: str) -> int:
+        """Stop monitoring a file, or every monitored file below a directory. Returns how many were removed."""
+        with self._lock:
+            removed = self.index.remove_subtree(path)
+            if removed:
+                remove_subtree(path)
+            if path in self.index:
+                self.index.discard(path)
+                remove_file(path)
+                removed.append(path)
+            for p in removed:
+                del self.by_path[p]
+            if removed:
+                gone = set(removed)
+                self.files[:] = [f for f in self.files if f.path not in gone]
+            if self.roots.pop(path, None) is not None:
+                save_roots(self.roots)
+        return len(removed)
+
+    def handle(self, request: Dict) -> Dict:
+        """Answer one request from the in-memory state."""
+        cmd = request.get("cmd")
+        if cmd == "ping":
+            return {"ok": True, "files": len(self.files), "last_scan": self.last_scan}
+        if cmd == "status":
+            file_info = self.by_path.get(request["path"]) or self.by_path.get(str(normalize_path(request["path"])))
+            if file_info is None:
+                return {"ok": False, "error": "not monitored"}
+            return {"ok": True, "file": file_info.to_dict()}
+        if cmd == "list":
+            directory = request.get("dir")
+            directory = str(normalize_path(directory)) if directory is not None else None
+            recursive, pattern = not request.get("no_recursive"), request.get("pattern")
+            paths = self.index.subtree(directory, recursive, pattern, request.get("after"), request.get("limit"))
+            return {"ok": True, "total": self.index.count(directory, recursive, pattern), "files": paths}
+        if cmd == "add":
+            path = normalize_path(request["path"])
+            if not path.exists():
+                return {"ok": False, "error": f"{path} does not exist"}
+            return {"ok": True, "added": self.add(path, bool(request.get("recursive")))}
+        if cmd == "remove":
+            return {"ok": True, "removed": self.remove(str(normalize_path(request["path"])))}
+        if cmd == "scan":
+            return {"ok": True, "events": [event.to_dict() for event in self.scan()]}
+        if cmd == "recent":
+            return {"ok": True, "events": list(self.recent)}
+        return {"ok": False, "error": f"unknown command {cmd!r}"}
+
+    def run_scanner(self) -> None:
+        """Scan every interval seconds at a fixed rate until stopped."""
+        next_scan = time.monotonic()
+        while not self._stop.wait(max(0.0, next_scan - time.monotonic())):
+            try:
+                self.scan()
+            except Exception:
+                logger.exception("Scan failed.")
+            next_scan += self.interval
+            if next_scan < time.monotonic():
+                logger.warning("Scan took longer than the interval, skipping to the next one.")
+                next_scan = time.monotonic() + self.interval
+
+    def stop(self) -> None:
+        self._stop.set()
+        for subscriber in list(self._subscribers):
+            self.unsubscribe(subscriber)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """One JSON request per line, one JSON response per line. "events" streams events until the client leaves."""
+
+    def handle(self) -> None:
+        daemon: MonitorDaemon = self.server.monitor
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError:
+                self._send({"ok": False, "error": "invalid JSON"})
+                continue
+
+            if request.get("cmd") == "events":
+                self._stream(daemon)
+                return
+
+            try:
+                response = daemon.handle(request)
+            except Exception as exc:
+                response = {"ok": False, "error": str(exc)}
+            self._send(response)
+
+    def _stream(self, daemon: MonitorDaemon) -> None:
+        subscriber = daemon.subscribe()
+        try:
+            while True:
+                data = subscriber.get()
+                if data is None:
+                    return
+                self._send(data)
+        except OSError:
+            #the client went away
+            pass
+        finally:
+            daemon.unsubscribe(subscriber)
+
+    def _send(self, data: Dict) -> None:
+        self.wfile.write(json.dumps(data).encode() + b"\n")
+        self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def daemon_running(socket_path: Path = SOCKET_PATH) -> bool:
+    """Check if a daemon answers on the socket (a socket left behind by a daemon that died does not)."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+    return True
+
+def serve(interval: float = 5.0, socket_path: Path = SOCKET_PATH) -> None:
+    """Run the daemon: continuous scanning plus the socket API. Runs until interrupted.
+
+    Raises RuntimeError if another daemon is already listening on the socket.
+    """
+    #only a stale socket is replaced, never the one of a running daemon
+    if daemon_running(socket_path):
+        raise RuntimeError(f"A daemon is already listening on {socket_path}.")
+    daemon = MonitorDaemon(interval)
+
+    socket_path.parent.mkdir(exist_ok=True)
+    if socket_path.exists():
+        socket_path.unlink()
+
+    server = _Server(str(socket_path), _RequestHandler)
+    server.monitor = daemon
+    os.chmod(socket_path, 0o600)
+
+    scanner = threading.Thread(target=daemon.run_scanner, name="scanner", daemon=True)
+    scanner.start()
+    logger.info(f"Daemon monitoring {len(daemon.files)} files, listening on {socket_path}.")
+    print(f"File Monitor daemon listening on {socket_path}. Press Ctrl+C to stop.")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Daemon stopped by user.")
+    finally:
+        daemon.stop()
+        server.server_close()
+        socket_path.unlink(missing_ok=True)
+
+
+def send_command(request: Dict, socket_path: Path = SOCKET_PATH):
+    """Send one request to a running daemon. Yields the responses (one, or many for "events")."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            for line in f:
+                yield json.loads(line)
+                if request.get("cmd") != "events":
+                    return
+
+
+def main() -> int:
+    """Command line: run the daemon or send it a query."""
+    parser = argparse.ArgumentParser(description="File Monitor daemon and client.")
+    parser.add_argument("--socket", type=Path, default=SOCKET_PATH)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run", help="run the daemon")
+    run.add_argument("--interval", type=float, default=5.0)
+    for name in ("status", "remove"):
+        sub.add_parser(name).add_argument("path")
+    add = sub.add_parser("add")
+    add.add_argument("path")
+    add.add_argument("--recursive", action="store_true")
+    listing = sub.add_parser("list")
+    listing.add_argument("--dir", help="only the files below this directory")
+    listing.add_argument("--no-recursive", action="store_true", default=None, help="only the files directly in --dir")
+    listing.add_argument("--pattern", help="glob on the full path")
+    listing.add_argument("--after", help="start after this path (the last path of the previous page)")
+    listing.add_argument("--limit", type=int)
+    for name in ("ping", "scan", "recent", "events"):
+        sub.add_parser(name)
+    args = parser.parse_args()
+
+    if args.cmd == "run":
+        setup_logging()
+        try:
+            serve(args.interval, args.socket)
+        except RuntimeError as exc:
+            print(f"Error: {exc}", file=sys.stderr)
+            return 1
+        return 0
+
+    request = {key: value for key, value in vars(args).items() if key != "socket" and value is not None}
+    try:
+        for response in send_command(request, args.socket):
+            print(json.dumps(response))
+            if response.get("ok") is False:
+                return 1
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"No daemon is listening on {args.socket}.", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
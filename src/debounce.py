@@ -0,0 +1,98 @@
+#src/debounce.py
+from __future__ import annotations
+from typing import Dict, List, Tuple
+from src.events import Event, EventType
+from src.records import FileRecord
+
+#a file that changes again within SETTLE_WINDOW seconds of its last reported change is "in motion" (a log being
+#written, a database being loaded): it is not hashed and its size and mtime are not compared until it has not changed
+#for SETTLE_WINDOW seconds, then one COALESCED event covers all the changes in between (owner, group and permissions
+#are compared on every pass). should be longer than the scan interval (0 disables it)
+SETTLE_WINDOW: float = 30.0
+
+#a file that never settles is compared anyway after this many seconds in motion, so touching a file
+#continuously cannot hide a change to it
+SETTLE_MAX_DELAY: float = 600.0
+
+
+class Motion:
+    """A file in motion: when it was first and last seen changing and how many changes were seen."""
+
+    __slots__ = ("first_seen", "last_seen", "changes", "fingerprint")
+
+    def __init__(self, now: float, fingerprint: Tuple[int, ...]) -> None:
+        self.first_seen = now
+        self.last_seen = now
+        self.changes = 1
+        self.fingerprint = fingerprint
+
+
+class Debouncer:
+    """Remembers recently changed files across scan passes and decides which ones to defer."""
+
+    def __init__(self, window: float = SETTLE_WINDOW, max_delay: float = SETTLE_MAX_DELAY) -> None:
+        self.window = window
+        self.max_delay = max_delay
+
+        #time of the last reported change of recently changed files
+        self._changed: Dict[str, float] = {}
+        self._moving: Dict[str, Motion] = {}
+        self._settled: Dict[str, Motion] = {}
+
+    def __len__(self) -> int:
+        """Number of files in motion."""
+        return len(self._moving)
+
+    def expire(self, now: float) -> None:
+        """Forget changes older than the window (called once per pass)."""
+        self._changed = {path: ts for path, ts in self._changed.items() if now - ts < self.window}
+
+    def defer(self, record: FileRecord, fingerprint: Tuple[int, ...], now: float) -> bool:
+        """Check if the file with this stat fingerprint is still in motion and should be skipped in this pass."""
+        if self.window <= 0:
+            return False
+        path = record.path
+        motion = self._moving.get(path)
+
+        if motion is None:
+            #(a record without a fingerprint could not be hashed, it is retried and not put in motion)
+            if record.fingerprint is None or fingerprint == record.fingerprint:
+                return False
+            #a single change is reported right away, a second one within the window starts a motion
+            last = self._changed.get(path)
+            if last is None or now - last >= self.window:
+                self._changed[path] = now
+                return False
+            self._moving[path] = Motion(now, fingerprint)
+            return True
+
+        if fingerprint != motion.fingerprint:
+            motion.fingerprint = fingerprint
+            motion.last_seen = now
+            motion.changes += 1
+
+        #quiet for the window (or in motion for too long): compare it in this pass
+        if now - motion.last_seen >= self.window or now - motion.first_seen >= self.max_delay:
+            self._settled[path] = self._moving.pop(path)
+            self._changed[path] = now
+            return False
+        return True
+
+    def forget(self, path: str) -> None:
+        """Drop a file that is gone or no longer monitored."""
+        self._changed.pop(path, None)
+        self._moving.pop(path, None)
+        self._settled.pop(path, None)
+
+    def coalesce(self, path: str, events: List[Event]) -> List[Event]:
+        """Replace the events of a file that just settled with one COALESCED event (other files' events are returned as is)."""
+        motion = self._settled.pop(path, None)
+        if motion is None or not events:
+            return events
+        details = {
+            "first_seen": motion.first_seen,
+            "last_seen": motion.last_seen,
+            "changes": motion.changes,
+            "events": [{"type": event.type.value, "old": event.old, "new": event.new} for event in events],
+        }
+        return [Event(EventType.COALESCED, path, None, details, max(event.severity for event in events))]
@@ -0,0 +1,124 @@
+#src/events.py
+from __future__ import annotations
+import os
+from datetime import datetime
+from enum import Enum, IntEnum
+from typing import Any, Dict, Iterable, Iterator
+
+
+class Severity(IntEnum):
+    """Event severity, ordered so events can be filtered with a minimum severity."""
+    INFO = 1
+    WARNING = 2
+    CRITICAL = 3
+
+
+class EventType(Enum):
+    """Kinds of changes detected by a scan. The value is the tag shown in the text form."""
+    MISSING = "MISSING"
+    CREATED = "CREATED"
+    OWNER_CHANGED = "OWNER_CHANGED"
+    GROUP_CHANGED = "GROUP_CHANGED"
+    PERMISSIONS_CHANGED = "PERMISSIONS_CHANGED"
+    SIZE_CHANGED = "SIZE_CHANGED"
+    MODIFIED = "MODIFIED"
+    HASH_CHANGED = "HASH_CHANGED"
+    APPENDED = "APPENDED"
+    BLOCKS_CHANGED = "BLOCKS_CHANGED"
+    COALESCED = "COALESCED"
+
+
+#i consider hash changes and missing files as critical, owner/group/permission changes as warning, size/modification as info
+#(a block-hashed file that only grew is info, its earlier content was verified unchanged)
+SEVERITIES = {
+    EventType.MISSING: Severity.CRITICAL,
+    EventType.HASH_CHANGED: Severity.CRITICAL,
+    EventType.BLOCKS_CHANGED: Severity.CRITICAL,
+    EventType.CREATED: Severity.WARNING,
+    EventType.OWNER_CHANGED: Severity.WARNING,
+    EventType.GROUP_CHANGED: Severity.WARNING,
+    EventType.PERMISSIONS_CHANGED: Severity.WARNING,
+    EventType.SIZE_CHANGED: Severity.INFO,
+    EventType.MODIFIED: Severity.INFO,
+    EventType.APPENDED: Severity.INFO,
+    #the changes of a file that was in motion, reported once it settled (with the highest severity among them)
+    EventType.COALESCED: Severity.WARNING,
+}
+
+#attribute names used in the "changed from old -> new" messages
+_LABELS = {
+    EventType.OWNER_CHANGED: "owner",
+    EventType.GROUP_CHANGED: "group",
+    EventType.PERMISSIONS_CHANGED: "permissions",
+    EventType.SIZE_CHANGED: "size",
+    EventType.MODIFIED: "last modified time",
+}
+
+
+class Event:
+    """A detected change. The text form is only built when the event is displayed or logged."""
+
+    __slots__ = ("type", "path", "old", "new", "severity")
+
+    def __init__(self, type: EventType, path: str, old: Any = None, new: Any = None, severity: Severity | None = None) -> None:
+        self.type = type
+        self.path = path
+        self.old = old
+        self.new = new
+        self.severity = severity if severity is not None else SEVERITIES[type]
+
+    @property
+    def message(self) -> str:
+        """Render the event the way it is shown on the console and in the log."""
+        tag = f"[{self.type.value}]"
+        if self.type is EventType.MISSING:
+            return f"{tag} {self.path} does not exist."
+        if self.type is EventType.CREATED:
+            return f"{tag} {self.path} was created and is now monitored."
+
+        name = os.path.basename(self.path)
+        if self.type is EventType.HASH_CHANGED:
+            return f"{tag} {name} hash value changed."
+        if self.type is EventType.APPENDED:
+            return f"{tag} {name} grew from {self.old} -> {self.new} bytes, earlier content unchanged."
+        if self.type is EventType.BLOCKS_CHANGED:
+            ranges = ", ".join(f"{start}-{end}" for start, end in self.new)
+            return f"{tag} {name} content changed at bytes {ranges}."
+        if self.type is EventType.COALESCED:
+            first = datetime.fromtimestamp(self.new["first_seen"]).isoformat(timespec='seconds')
+            last = datetime.fromtimestamp(self.new["last_seen"]).isoformat(timespec='seconds')
+            kinds = ", ".join(event["type"] for event in self.new["events"])
+            return f"{tag} {name} changed {self.new['changes']} time(s) between {first} and {last}, now settled ({kinds})."
+
+        old, new = self.old, self.new
+        if self.type is EventType.MODIFIED:
+            #timestamps are kept numeric and only formatted here
+            old = datetime.fromtimestamp(old).isoformat(timespec='seconds')
+            new = datetime.fromtimestamp(new).isoformat(timespec='seconds')
+        return f"{tag} {name} {_LABELS[self.type]} changed from {old} -> {new}."
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain form of the event for JSON output."""
+        return {
+            "type": self.type.value,
+            "severity": self.severity.name,
+            "path": self.path,
+            "old": self.old,
+            "new": self.new,
+            "message": self.message,
+        }
+
+    def __str__(self) -> str:
+        return self.message
+
+    def __repr__(self) -> str:
+        return f"Event({self.type.name}, {self.path!r}, {self.old!r}, {self.new!r})"
+
+
+def filter_events(events: Iterable[Event], types: Iterable[EventType] | None = None,
+                  min_severity: Severity = Severity.INFO) -> Iterator[Event]:
+    """Yield the events of the given types with at least the given severity."""
+    types = set(types) if types is not None else None
+    for event in events:
+        if event.severity >= min_severity and (types is None or event.type in types):
+            yield event
@@ -0,0 +1,131 @@
+#src/log_pipeline.py
+from __future__ import annotations
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import List
+from src.events import Event
+
+
+class PipelineQueueHandler(logging.handlers.QueueHandler):
+    """Puts records on the pipeline queue. When the queue is full the record is dropped (and counted)
+    unless block is set, in which case the caller waits (back-pressure)."""
+
+    def __init__(self, log_queue: queue.Queue, block: bool = False) -> None:
+        super().__init__(log_queue)
+        self.block = block
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        #unlike QueueHandler, do not format here: the message (e.g. the text of an Event) is
+        #rendered on the pipeline thread so the scan does not pay for it
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Batched:
+    """Mixin for stream handlers: no flush per record, the pipeline flushes once per batch."""
+
+    def flush(self) -> None:
+        pass
+
+    def flush_batch(self) -> None:
+        super().flush()
+
+    def close(self) -> None:
+        self.flush_batch()
+        super().close()
+
+
+class BatchedFileHandler(_Batched, logging.FileHandler):
+    """FileHandler flushed once per batch."""
+
+
+class BatchedRotatingFileHandler(_Batched, logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler flushed once per batch."""
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record. Records logged with an Event argument carry its typed fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if isinstance(record.args, tuple) and record.args and isinstance(record.args[0], Event):
+            event = record.args[0]
+            data.update(event=event.type.value, severity=event.severity.name, path=event.path,
+                        old=event.old, new=event.new)
+        return json.dumps(data, default=str)
+
+
+class LogPipeline:
+    """Background thread that takes records off the queue and writes them to the sinks in batches,
+    flushing after batch_size records or flush_interval seconds, whichever comes first."""
+
+    def __init__(self, log_queue: queue.Queue, handler: PipelineQueueHandler, sinks: List[logging.Handler],
+                 batch_size: int = 500, flush_interval: float = 1.0) -> None:
+        self.queue = log_queue
+        self.handler = handler
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._reported_drops = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-pipeline", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Write what is still queued and close the sinks."""
+        self._stop.set()
+        self._thread.join()
+        for sink in self.sinks:
+            sink.close()
+
+    def _run(self) -> None:
+        while not (self._stop.is_set() and self.queue.empty()):
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch: List[logging.LogRecord]) -> None:
+        #report dropped records in the log itself
+        dropped = self.handler.dropped
+        if dropped != self._reported_drops:
+            batch.append(logging.makeLogRecord({
+                "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": f"Log queue full, dropped {dropped - self._reported_drops} record(s).",
+            }))
+            self._reported_drops = dropped
+
+        if not batch:
+            return
+        for sink in self.sinks:
+            for record in batch:
+                if record.levelno >= sink.level:
+                    sink.handle(record)
+            if isinstance(sink, _Batched):
+                sink.flush_batch()
+            else:
+                sink.flush()
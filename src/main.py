@@ -5,35 +5,62 @@ from pathlib import Path
 import logging
 import time
 from typing import List, Dict
-from src.monitor import get_file_metadata, scan_once
-from src.storage import load_files, save_files, add_file, remove_file
+from src.monitor import get_file_metadata, scan_once, collect_metadata, watch_root, scan_roots
+from src.storage import (load_files, save_files, update_files, add_file, add_files, remove_file, load_roots, save_roots,
+                         list_files, count_files, remove_subtree)
+from src.watcher import watch_and_scan
+from src.pipeline import stream_scan
+from src.scheduler import Scheduler, load_schedule_rules, run_fixed_rate
+from src.metrics import ScanStats, record_scan, profiled
+from src.events import Event
+from src.debounce import Debouncer
 from src.permissions import get_permissions_str, get_permission_octal, set_permissions_octal, modify_permission
-from src.utils import setup_logging, format_event, iter_directory_files, normalize_path
+from src.utils import setup_logging, format_event, normalize_path, walk_files, DEFAULT_EXCLUDES, WALK_WORKERS
 
+#print a progress line every PROGRESS_INTERVAL files when adding a directory
+PROGRESS_INTERVAL = 1000
 
-def list_monitored_files() -> None:
-    """List all monitored files."""
-    files = load_files()
-    if not files:
-        print("No files are currently being monitored.")
+
+#number of files shown per page by list_monitored_files
+LIST_PAGE_SIZE = 50
+
+
+def list_monitored_files(directory: str | None = None, pattern: str | None = None, page_size: int = LIST_PAGE_SIZE) -> None:
+    """List the monitored files (below a directory and matching a glob pattern), one page at a time."""
+    total = count_files(directory, pattern=pattern)
+    if not total:
+        print("No files are currently being monitored." if directory is None and pattern is None else "No monitored files match.")
         return
-    print("\nMonitored Files:\n")
-    for file_info in files:
-        print(f"  Filename: {file_info['filename']}")
-        print(f"  Path: {file_info['path']}")
-        # print(f"  Size: {file_info['size']} bytes")
-        # print(f"  Permissions: {file_info['permissions']}")
-        # print(f"  Owner: {file_info['owner']}")
-        # print(f"  Group: {file_info['group']}")
-        # print(f"  Created: {file_info['created']}")
-        # print(f"  Created_ts: {file_info['created_ts']}")
-        # print(f"  Modified: {file_info['last_modified']}")
-        # print(f"  Modified_ts: {file_info['last_modified_ts']}")
-        # print(f"  Hash_Algorithm: {file_info['hash_algorithm']}")
-        # print(f"  Hash: {file_info['hash_value']}")
-        # print(f"  Last_Hash: {file_info['last_hash']}")
-        # print(f"  Last_Hash_ts: {file_info['last_hash_ts']}")
-        print("")
+    print(f"\nMonitored Files ({total}):\n")
+
+    after = None
+    shown = 0
+    while True:
+        files = list_files(directory, pattern=pattern, after=after, limit=page_size)
+        for file_info in files:
+            print(f"  Filename: {file_info.filename}")
+            print(f"  Path: {file_info.path}")
+            # print(f"  Size: {file_info.size} bytes")
+            # print(f"  Permissions: {file_info.permissions}")
+            # print(f"  Owner: {file_info.owner}")
+            # print(f"  Group: {file_info.group}")
+            # print(f"  Created: {file_info.created}")
+            # print(f"  Created_ts: {file_info.created_ts}")
+            # print(f"  Modified: {file_info.last_modified}")
+            # print(f"  Modified_ts: {file_info.last_modified_ts}")
+            # print(f"  Hash_Algorithm: {file_info.hash_algorithm}")
+            # print(f"  Hash: {file_info.hash_value}")
+            # print(f"  Last_Hash: {file_info.last_hash}")
+            # print(f"  Last_Hash_ts: {file_info.last_hash_ts}")
+            print("")
+        shown += len(files)
+
+        #the next page starts after the last path shown
+        if len(files) < page_size or shown >= total:
+            return
+        if input(f"Shown {shown} of {total}. Enter for more, q to stop: ").strip().lower() == "q":
+            return
+        after = files[-1].path
 
 def add_monitored_file() -> None:
     """Add a new file to be monitored."""
@@ -58,14 +85,47 @@ def add_monitored_directory() -> None:
     recursive_str = input("Monitor recursively? (y/n): ").strip().lower()
     recursive = recursive_str == "y"
 
-    added_files = 0
-    for file_path in iter_directory_files(directory, recursive):
-        file_info = get_file_metadata(file_path)
-        add_file(file_info)
-        added_files += 1
+    exclude_str = input(f"Exclude patterns, comma separated (Enter for {', '.join(DEFAULT_EXCLUDES)}, '-' for none): ").strip()
+    if not exclude_str:
+        exclude = DEFAULT_EXCLUDES
+    elif exclude_str == "-":
+        exclude = []
+    else:
+        exclude = [p.strip() for p in exclude_str.split(",") if p.strip()]
+
+    include_str = input("Only include patterns, comma separated (Enter for all files): ").strip()
+    include = [p.strip() for p in include_str.split(",") if p.strip()]
 
+    watch_str = input("Watch the directory for new files? (y/n): ").strip().lower()
+    watch = watch_str == "y"
+
+    added_files = register_directory(directory, recursive, watch=watch, include=include, exclude=exclude)
     print(f"Started monitoring {added_files} files in {dir_str}.")
 
+def register_directory(directory: Path, recursive: bool, show_progress: bool = True, watch: bool = False,
+                       **walk_options) -> int:
+    """Collect the metadata of every file in a directory and add them to monitoring in one batch.
+
+    walk_options are passed to walk_files (include, exclude, max_depth, skip_hidden, one_filesystem).
+    With watch, the directory is also stored as a watched root so files created later are picked up.
+    """
+
+    if watch:
+        root, entries = watch_root(directory, recursive, WALK_WORKERS, **walk_options)
+        roots = load_roots()
+        roots[root["path"]] = root
+        save_roots(roots)
+    else:
+        entries = walk_files(directory, recursive, workers=WALK_WORKERS, **walk_options)
+
+    file_infos = []
+    for count, file_info in enumerate(collect_metadata(entries), 1):
+        file_infos.append(file_info)
+        if show_progress and count % PROGRESS_INTERVAL == 0:
+            print(f"  {count} files processed...")
+
+    return add_files(file_infos)
+
 def remove_monitored_file() -> None:
     """Remove a file from being monitored."""
     path_str = input("Enter the path of the file to stop monitoring: ").strip()
@@ -77,70 +137,127 @@ def remove_monitored_directory() -> None:
     """Remove all files in a directory from being monitored."""
     dir_str = input("Enter the path of the directory to stop monitoring: ").strip()
     directory = normalize_path(dir_str)
-    if not directory.is_dir():
-        print(f"{dir_str} is not a valid directory.")
-        return
 
     recursive_str = input("Remove recursively? (y/n): ").strip().lower()
     recursive = recursive_str == "y"
 
-    removed_files = 0
-    monitored_files = load_files()
-    paths_to_remove = {str(p) for p in iter_directory_files(directory, recursive)}
+    #the files are found in the stored paths, so a directory that was deleted can be removed as well
+    removed_files = remove_subtree(str(directory), recursive)
 
-    new_monitored_files = []
-    for file_info in monitored_files:
-        if file_info["path"] in paths_to_remove:
-            removed_files += 1
-        else:
-            new_monitored_files.append(file_info)
+    #stop watching the directory for new files
+    roots = load_roots()
+    if roots.pop(str(directory), None) is not None:
+        save_roots(roots)
 
-    save_files(new_monitored_files)
     print(f"Stopped monitoring {removed_files} files in {dir_str}.")
 
 def scan_once_and_report() -> None:
-    """Perform a single scan of monitored files and report changes."""
-    files = load_files()
-    if not files:
+    """Perform a single scan of monitored files and report changes as they are found."""
+    if not count_files() and not load_roots():
         print("No files are currently being monitored.")
         return
 
-    events = scan_once(files)
-    save_files(files)
+    #the baseline is streamed through the scan in chunks, each written back (and checkpointed) when it is done
+    scan_stats = ScanStats()
+    changes = 0
+    with profiled("scan"):
+        for event in stream_scan(scan_stats=scan_stats):
+            if not changes:
+                print("Changes detected:")
+            print(" --- ", format_event(event))
+            changes += 1
+    record_scan(scan_stats)
 
-    if not events:
+    if not changes:
         print("No changes detected.")
-    else:
-        print("Changes detected:")
-        for event in events:
-            print(" --- ", format_event(event))
 
 def continuous_scan(interval: int = 5) -> None:
-    """Continuously scan monitored files at specified intervals."""
+    """Continuously scan monitored files, each one at its scheduled interval (default every interval seconds)."""
 
     files = load_files()
-    if not files:
+    roots = load_roots()
+    if not files and not roots:
         print("No files are currently being monitored.")
         return
 
-    print(f"Starting continuous scan every {interval} seconds. Press Ctrl+C to stop.")
+    #per-pattern intervals come from the schedule file, every other file is scanned every interval seconds
+    scheduler = Scheduler(interval, load_schedule_rules())
 
-    try:
-        while True:
-            events = scan_once(files)
-            save_files(files)
+    #files that change on every tick are only hashed and reported once they settle
+    debouncer = Debouncer()
+    by_path = {f.path: f for f in files}
+    order = {path: i for i, path in enumerate(by_path)}
+    now = time.monotonic()
+    for path in by_path:
+        scheduler.add(path, now)
+    next_roots_scan = now
 
-            if events:
-                print("Changes detected:")
-                for event in events:
-                    print(" --- ", format_event(event))
-            else:
-                print("No changes detected.")
+    def tick(now: float) -> None:
+        nonlocal next_roots_scan
+        events = []
+        scan_stats = ScanStats()
+
+        #watched roots are checked for new files every interval seconds
+        if roots and now >= next_roots_scan:
+            count = len(files)
+            with scan_stats.phase("roots"):
+                events += scan_roots(roots, files)
+                #store the new files before the directory mtimes, or a stop before they are due would lose them
+                if len(files) > count:
+                    add_files(files[count:])
+                save_roots(roots)
+            scan_stats.count_events(events)
+            for file_info in files[count:]:
+                by_path[file_info.path] = file_info
+                order[file_info.path] = len(order)
+                scheduler.add(file_info.path, now)
+            next_roots_scan = now + interval
+
+        #scan the files that are due in this tick (in monitoring order) and write back only the ones that changed
+        due = sorted(scheduler.due(now), key=order.__getitem__)
+        if due:
+            due_files = [by_path[path] for path in due]
+            before = [(f.state(), f.merkle) for f in due_files]
+            with profiled("tick"):
+                events += scan_once(due_files, scan_stats=scan_stats, debounce=debouncer)
+                changed = [f for f, old in zip(due_files, before) if (f.state(), f.merkle) != old]
+                if changed:
+                    with scan_stats.phase("save"):
+                        update_files(changed)
+        record_scan(scan_stats)
 
-            time.sleep(interval)
+        if events:
+            print("Changes detected:")
+            for event in events:
+                print(" --- ", format_event(event))
+
+    print(f"Starting continuous scan every {interval} seconds ({len(scheduler)} files scheduled). Press Ctrl+C to stop.")
+
+    try:
+        run_fixed_rate(tick, scheduler.tick_interval)
     except KeyboardInterrupt:
         print("Continuous scanning stopped by user.")
 
+def realtime_scan() -> None:
+    """Scan monitored files as soon as the kernel reports changes to them (inotify)."""
+
+    files = load_files()
+    if not files:
+        print("No files are currently being monitored.")
+        return
+
+    def report(events: List[Event]) -> None:
+        save_files(files)
+        for event in events:
+            print(" --- ", format_event(event))
+
+    print("Starting real-time monitoring. Press Ctrl+C to stop.")
+
+    try:
+        watch_and_scan(files, report)
+    except KeyboardInterrupt:
+        print("Real-time monitoring stopped by user.")
+
 
 def main_menu() -> None:
     """Display the main menu and handle user input."""
@@ -155,12 +272,19 @@ def main_menu() -> None:
         print("5. Change file permissions")
         print("6. Get file permissions")
         print("7. Start continuous scanning")
-        print("8. Exit")
+        print("8. Start real-time monitoring (inotify)")
+        print("9. Exit")
 
         choice = input("Enter your choice: ").strip()
 
         if choice == "1":
-            list_monitored_files()
+            filter_str = input("Filter by directory or glob pattern (Enter for all files): ").strip()
+            if not filter_str:
+                list_monitored_files()
+            elif any(c in filter_str for c in "*?["):
+                list_monitored_files(pattern=filter_str)
+            else:
+                list_monitored_files(str(normalize_path(filter_str)))
         elif choice == "2":
             file_action = input("Add or Remove file? (a/r): ").strip().lower()
             if file_action == "a":
@@ -204,12 +328,17 @@ def main_menu() -> None:
         elif choice == "7":
             try:
                 interval_str = input("Enter the scan interval in seconds (default 5): ").strip()
-                interval = int(interval_str) if interval_str.isdigit() else 5
+                interval = int(interval_str) if interval_str.isdigit() and int(interval_str) > 0 else 5
                 continuous_scan(interval)
             except Exception as exc:
                 print(f"Error starting continuous scan: {exc}")
-        
         elif choice == "8":
+            try:
+                realtime_scan()
+            except Exception as exc:
+                print(f"Error starting real-time monitoring: {exc}")
+        
+        elif choice == "9":
             print("Exiting File Monitor.")
             break
         else:
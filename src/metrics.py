@@ -0,0 +1,187 @@
+#src/metrics.py
+from __future__ import annotations
+import cProfile
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+from src.utils import atomic_write
+
+#write the metrics after every scan to this file: Prometheus text format for a ".prom" suffix, JSON otherwise
+#(e.g. Path("/var/lib/node_exporter/textfile_collector/file_monitor.prom")). None disables the export
+METRICS_FILE: Path | None = None
+
+#opt-in: dump a cProfile of every scan pass into this directory (open with python -m pstats)
+PROFILE_DIR: Path | None = None
+
+#upper bounds (seconds) of the scan duration histogram buckets
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class ScanStats:
+    """Timers and counters of one scan pass (or one continuous-scan tick)."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.phases: Dict[str, float] = defaultdict(float)
+        self.files_scanned = 0
+        self.files_hashed = 0
+        self.bytes_hashed = 0
+        self.hashes_skipped = 0
+        self.events: Counter = Counter()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Add the time spent in the with block to a phase (stat, nss, hash, compare, save, ...)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def count_events(self, events: Iterable) -> None:
+        """Count events by type."""
+        self.events.update(event.type.value for event in events)
+
+    def add(self, other: "ScanStats") -> None:
+        """Add the phase times and counters of another pass (e.g. of one shard) to this one."""
+        for name, seconds in other.phases.items():
+            self.phases[name] += seconds
+        self.files_scanned += other.files_scanned
+        self.files_hashed += other.files_hashed
+        self.bytes_hashed += other.bytes_hashed
+        self.hashes_skipped += other.hashes_skipped
+        self.events.update(other.events)
+
+    def finish(self) -> "ScanStats":
+        """Stop the pass timer."""
+        self.duration = time.perf_counter() - self.started
+        return self
+
+    def to_dict(self) -> Dict:
+        return {
+            "duration": self.duration,
+            "phases": dict(self.phases),
+            "files_scanned": self.files_scanned,
+            "files_hashed": self.files_hashed,
+            "bytes_hashed": self.bytes_hashed,
+            "hashes_skipped": self.hashes_skipped,
+            "events": dict(self.events),
+        }
+
+
+class MetricsRegistry:
+    """Totals over all passes of this process plus a histogram of scan durations."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.scans = 0
+        self.totals: Counter = Counter()
+        self.phases: Dict[str, float] = defaultdict(float)
+        self.events: Counter = Counter()
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.duration_sum = 0.0
+        self.last: ScanStats | None = None
+        self.last_time = 0.0
+
+    def record(self, stats: ScanStats) -> None:
+        """Add a finished pass to the totals."""
+        with self._lock:
+            self.scans += 1
+            self.totals.update(files_scanned=stats.files_scanned, files_hashed=stats.files_hashed,
+                               bytes_hashed=stats.bytes_hashed, hashes_skipped=stats.hashes_skipped)
+            for name, seconds in stats.phases.items():
+                self.phases[name] += seconds
+            self.events.update(stats.events)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if stats.duration <= bound:
+                    self.buckets[i] += 1
+            self.duration_sum += stats.duration
+            self.last = stats
+            self.last_time = time.time()
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "scans": self.scans,
+                "totals": dict(self.totals),
+                "phases": dict(self.phases),
+                "events": dict(self.events),
+                "duration_histogram": {
+                    "buckets": dict(zip(map(str, DURATION_BUCKETS), self.buckets)),
+                    "sum": self.duration_sum,
+                    "count": self.scans,
+                },
+                "last_scan": self.last.to_dict() if self.last else None,
+                "last_scan_time": self.last_time,
+            }
+
+    def to_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        data = self.to_dict()
+        lines = []
+
+        def metric(name: str, kind: str, help: str, samples: Iterable) -> None:
+            lines.append(f"# HELP file_monitor_{name} {help}")
+            lines.append(f"# TYPE file_monitor_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"file_monitor_{name}{labels} {value}")
+
+        metric("scans_total", "counter", "Number of scan passes.", [("", data["scans"])])
+        for key, help in (("files_scanned", "Files checked by scans."), ("files_hashed", "Files hashed by scans."),
+                          ("bytes_hashed", "Bytes read for hashing."), ("hashes_skipped", "Files whose hash was reused.")):
+            metric(f"{key}_total", "counter", help, [("", data["totals"].get(key, 0))])
+        metric("phase_seconds_total", "counter", "Time spent per scan phase.",
+               [(f'{{phase="{name}"}}', seconds) for name, seconds in sorted(data["phases"].items())])
+        metric("events_total", "counter", "Events detected by type.",
+               [(f'{{type="{name}"}}', count) for name, count in sorted(data["events"].items())])
+
+        #the histogram buckets are cumulative already (a pass is counted in every bucket it fits)
+        histogram = [(f'_bucket{{le="{bound}"}}', count) for bound, count in data["duration_histogram"]["buckets"].items()]
+        histogram += [('_bucket{le="+Inf"}', data["scans"]), ("_sum", data["duration_histogram"]["sum"]), ("_count", data["scans"])]
+        lines.append("# HELP file_monitor_scan_duration_seconds Duration of scan passes.")
+        lines.append("# TYPE file_monitor_scan_duration_seconds histogram")
+        lines.extend(f"file_monitor_scan_duration_seconds{suffix} {value}" for suffix, value in histogram)
+
+        last = data["last_scan"]
+        metric("last_scan_duration_seconds", "gauge", "Duration of the last scan pass.", [("", last["duration"] if last else 0)])
+        metric("last_scan_timestamp_seconds", "gauge", "Time the last scan pass finished.", [("", data["last_scan_time"])])
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Path) -> None:
+        """Write the metrics atomically so a scraper never reads a half written file."""
+        text = self.to_prometheus() if path.suffix == ".prom" else json.dumps(self.to_dict(), indent=4)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(path) as tmp_file:
+            tmp_file.write_text(text, encoding="utf-8")
+
+
+registry = MetricsRegistry()
+
+def record_scan(stats: ScanStats) -> ScanStats:
+    """Finish a pass, add it to the registry and export the metrics file if one is configured."""
+    stats.finish()
+    registry.record(stats)
+    if METRICS_FILE is not None:
+        registry.export(METRICS_FILE)
+    return stats
+
+@contextmanager
+def profiled(name: str) -> Iterator[None]:
+    """Profile the with block with cProfile when PROFILE_DIR is set."""
+    if PROFILE_DIR is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(PROFILE_DIR / f"{name}-{time.time_ns()}.pstats"))
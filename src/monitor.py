@@ -4,41 +4,269 @@ from pathlib import Path
 import time
 import os
 import hashlib
+import mmap
 import stat
-from datetime import datetime
+import threading
+import zlib
 import logging
-from typing import List, Dict
+from typing import Callable, Iterable, Iterator, List, Dict, Tuple
 import pwd
 import grp
 from src.storage import load_files, save_files
+from src.utils import advise, bounded_map, walk_files
+from src.events import Event, EventType
+from src.records import FileRecord, UNREADABLE
+from src.blockhash import BlockUpdate, is_merkle, merkle_algorithm, samples, update_tree, uses_blocks
+from src.debounce import Debouncer
+from src.throttle import IOBudget
+from src.metrics import ScanStats
 
 logger = logging.getLogger(__name__)
 
+#algorithm used for new hashes (any hashlib algorithm, e.g. "blake2b" is faster than sha256 on 64-bit CPUs)
+#records keep the algorithm they were hashed with and are moved to this one on their next rehash
 HASH_ALGORITHM: str = "sha256"
 
-def calculate_hash(path: Path) -> str:
-    """Calculate the hash of a file using the specified hashing algorithm. Default is SHA-256."""
-    
+#read buffer size is picked between these bounds from the file size
+MIN_BUFFER_SIZE: int = 64 * 1024
+MAX_BUFFER_SIZE: int = 1024 * 1024
+
+#optionally mmap files of at least MMAP_THRESHOLD bytes instead of reading them
+#(off by default: a file truncated while it is mapped raises SIGBUS)
+USE_MMAP: bool = False
+MMAP_THRESHOLD: int = 64 * 1024 * 1024
+
+#files whose stat fingerprint did not change are not rehashed, except once every FULL_REHASH_INTERVAL seconds
+#to catch tampering that preserves timestamps (0 disables the paranoid rehash). the rehashes are spread
+#over the interval, so e.g. 24h means "all files verified within 24h"
+FULL_REHASH_INTERVAL: float = 24 * 60 * 60
+
+#I/O budget of scan_once hashing (0 means unlimited)
+SCAN_BYTES_PER_SEC: float = 0
+SCAN_FILES_PER_SEC: float = 0
+
+#drop hashed files from the page cache (every DROP_CACHE_EVERY bytes and at the end) so scans do not pollute it
+DROP_CACHE_AFTER_HASH: bool = True
+DROP_CACHE_EVERY: int = 32 * 1024 * 1024
+
+#owner/group names are cached for NAME_CACHE_TTL seconds (entries are also dropped when /etc/passwd or /etc/group change)
+NAME_CACHE_TTL: float = 300.0
+
+#number of threads hashing files concurrently and how many files may be queued for them
+#(hashlib releases the GIL on large updates so threads scale with the disk)
+HASH_WORKERS: int = min(8, os.cpu_count() or 1)
+HASH_QUEUE_DEPTH: int = 64
+
+#thread-local reusable read buffer so hashing does not allocate a new bytes object per chunk
+_buffers = threading.local()
+
+def _get_buffer(size: int) -> memoryview:
+    """Return a reusable buffer of the given size for the current thread."""
+    buffer = getattr(_buffers, "buffer", None)
+    if buffer is None or len(buffer) < size:
+        buffer = bytearray(size)
+        _buffers.buffer = buffer
+    return memoryview(buffer)[:size]
+
+def calculate_hashes(path: Path, algorithms: Iterable[str], budget: IOBudget | None = None) -> Dict[str, str] | None:
+    """Calculate the hashes of a file for several algorithms while reading it only once.
+
+    With a budget, opening the file and every chunk read wait for the scan's I/O budget.
+    Returns None when the file cannot be read.
+    """
+
     try:
-        #create hash object
-        hash = hashlib.new(HASH_ALGORITHM)
+        #create hash objects (hashlib raises ValueError for unsupported algorithms)
+        hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+        updates = [h.update for h in hashes.values()]
+
+        if budget is not None:
+            budget.open_file()
+
+        with path.open("rb", buffering=0) as f:
+            fd = f.fileno()
+            size = os.fstat(fd).st_size
+
+            #tell the kernel we read sequentially (bigger readahead)
+            advise(fd, 0, 0, "SEQUENTIAL")
+
+            if USE_MMAP and size >= MMAP_THRESHOLD:
+                #map large files and hash slices of the mapping without copying them
+                with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                    for offset in range(0, len(view), MAX_BUFFER_SIZE):
+                        with view[offset:offset + MAX_BUFFER_SIZE] as chunk:
+                            for update in updates:
+                                update(chunk)
+                            if budget is not None:
+                                budget.read(len(chunk))
+            else:
+                #pick the buffer size from the file size and read into it until EOF
+                buffer = _get_buffer(min(MAX_BUFFER_SIZE, max(MIN_BUFFER_SIZE, size)))
+                offset = 0
+                while True:
+                    n = f.readinto(buffer)
+                    if not n:
+                        break
+                    chunk = buffer[:n] if n < len(buffer) else buffer
+                    for update in updates:
+                        update(chunk)
+                    if budget is not None:
+                        budget.read(n)
 
-        with path.open("rb") as f:
-            #read file in chunks until EOF
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash.update(chunk)
+                    #drop what was read so far from the page cache as we go for large files
+                    offset += n
+                    if DROP_CACHE_AFTER_HASH and offset % DROP_CACHE_EVERY < n:
+                        advise(fd, 0, offset, "DONTNEED")
+
+            #do not leave the file in the page cache, so scans do not fill it with the files they hashed
+            #(this drops every cached page of the file, also the ones the application had cached before)
+            if DROP_CACHE_AFTER_HASH:
+                advise(fd, 0, 0, "DONTNEED")
     except PermissionError:
         logger.error(f"Permission denied when accessing file {path} for hashing.")
         return None
-    #return hash digest as hexadecimal string        
-    return hash.hexdigest()
+    except OSError as e:
+        #deleted or replaced since it was listed, or a read error: reported as missing or unreadable
+        logger.warning(f"Cannot read file {path} for hashing: {e}")
+        return None
+    #return hash digests as hexadecimal strings
+    return {algorithm: h.hexdigest() for algorithm, h in hashes.items()}
+
+def calculate_hash(path: Path, algorithm: str | None = None) -> str | None:
+    """Calculate the hash of a file using the specified hashing algorithm. Default is HASH_ALGORITHM."""
+    algorithm = algorithm or HASH_ALGORITHM
+    hashes = calculate_hashes(path, [algorithm])
+    return hashes[algorithm] if hashes else None
+
+def hash_algorithm_for(size: int) -> str:
+    """hash_algorithm of the record of a file of this size (a Merkle root for block-hashed files)."""
+    return merkle_algorithm(HASH_ALGORITHM) if uses_blocks(size) else HASH_ALGORITHM
+
+def hash_algorithms(previous: FileRecord | None, size: int) -> List[str]:
+    """Algorithms a file of this size has to be hashed with: the current one plus the one its baseline was stored with.
+
+    A file that is no longer block-hashed cannot be compared with its old Merkle root, it is left out.
+    """
+    algorithms = [hash_algorithm_for(size)]
+    if previous is not None and previous.hash_algorithm != algorithms[0] \
+            and (uses_blocks(size) or not is_merkle(previous.hash_algorithm)):
+        algorithms.append(previous.hash_algorithm)
+    return algorithms
+
+_scan_budget: IOBudget | None = None
+
+def get_scan_budget() -> IOBudget:
+    """Return the I/O budget scan_once hashes within (SCAN_BYTES_PER_SEC/SCAN_FILES_PER_SEC by default)."""
+    global _scan_budget
+    if _scan_budget is None:
+        _scan_budget = IOBudget(SCAN_BYTES_PER_SEC, SCAN_FILES_PER_SEC)
+    return _scan_budget
+
+def set_scan_budget(budget: IOBudget) -> None:
+    """Use a specific I/O budget for scans (e.g. from throttle.budget_for_window)."""
+    global _scan_budget
+    _scan_budget = budget
+
+class NameCache:
+    """Cache uid/gid -> name lookups across scans (NSS lookups can be network round trips)."""
+
+    def __init__(self, lookup: Callable[[int], str], source: str) -> None:
+        self._lookup = lookup
+        self._source = source
+        self._source_mtime: int | None = None
+        self._next_check = 0.0
+        self._entries: Dict[int, Tuple[str, float]] = {}
+
+        #time spent in actual (uncached) lookups, reported as the "nss" scan phase
+        self.lookup_seconds = 0.0
+
+    def _check_source(self) -> None:
+        """Drop every entry when the local database file changed."""
+        try:
+            mtime = os.stat(self._source).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._source_mtime:
+            self._entries.clear()
+            self._source_mtime = mtime
+
+    def name(self, id: int) -> str:
+        """Return the name for an id, or the id itself as a string when it no longer resolves."""
+        now = time.monotonic()
+
+        #check the source file at most once per second
+        if now >= self._next_check:
+            self._check_source()
+            self._next_check = now + 1.0
+
+        entry = self._entries.get(id)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+
+        start = time.perf_counter()
+        try:
+            name = self._lookup(id)
+        except KeyError:
+            name = str(id)
+        self.lookup_seconds += time.perf_counter() - start
+        self._entries[id] = (name, now + NAME_CACHE_TTL)
+        return name
+
+owner_names = NameCache(lambda uid: pwd.getpwuid(uid).pw_name, "/etc/passwd")
+group_names = NameCache(lambda gid: grp.getgrgid(gid).gr_name, "/etc/group")
+
+def get_fingerprint(stats: os.stat_result) -> Tuple[int, ...]:
+    """Build the stat fingerprint used to decide if a file needs rehashing."""
+    return (stats.st_dev, stats.st_ino, stats.st_size, stats.st_mtime_ns, stats.st_ctime_ns)
+
+def rehash_due(file_info: FileRecord, now: float) -> bool:
+    """Check if a file is due for a paranoid full rehash regardless of its fingerprint.
+
+    Every file gets a stable phase inside FULL_REHASH_INTERVAL and is rehashed once per interval at that
+    phase, so a full verification of a tree is spread over the whole interval instead of done in bursts.
+    """
+    if FULL_REHASH_INTERVAL <= 0:
+        return False
+    phase = zlib.crc32(file_info.path.encode()) / 2**32 * FULL_REHASH_INTERVAL
+    return (now + phase) // FULL_REHASH_INTERVAL > (file_info.last_hash_ts + phase) // FULL_REHASH_INTERVAL
+
+def needs_hash(previous: FileRecord | None, fingerprint: Tuple[int, ...], force_hash: bool = False) -> bool:
+    """Check if a file has to be hashed or if the stored hash can be reused."""
+    if previous is None or force_hash or previous.digest == UNREADABLE:
+        return True
+    return previous.fingerprint != fingerprint or previous.hash_algorithm != hash_algorithm_for(fingerprint[2])
+
+def hash_files(paths: Dict[Tuple, Tuple[Path, List[str]]],
+               budget: IOBudget | None = None) -> Dict[Tuple, Dict[str, str] | None]:
+    """Hash many files concurrently. Keys are fingerprints so hardlinks are only listed once."""
+    keys = list(paths)
+    hashes = bounded_map(lambda key: calculate_hashes(*paths[key], budget), keys, HASH_WORKERS, HASH_QUEUE_DEPTH)
+    return dict(zip(keys, hashes))
+
+def hash_file_blocks(paths: Dict[Tuple, Tuple[Path, Dict | None, List[str], bool, bool]],
+                     budget: IOBudget | None = None) -> Dict[Tuple, BlockUpdate | None]:
+    """Update the block trees of many large files concurrently
+    ((path, stored tree, algorithms, full pass, sample only) per fingerprint)."""
+    keys = list(paths)
+
+    def update(key: Tuple) -> BlockUpdate | None:
+        path, tree, algorithms, full, sample = paths[key]
+        return update_tree(path, tree, algorithms, full, budget, DROP_CACHE_AFTER_HASH, sample)
+
+    updates = bounded_map(update, keys, HASH_WORKERS, HASH_QUEUE_DEPTH)
+    return dict(zip(keys, updates))
 
-def get_file_metadata(path: Path) -> Dict:
+def collect_metadata(entries: Iterable[Tuple[Path, os.stat_result | None]]) -> Iterator[FileRecord]:
+    """Retrieve metadata for many (path, stat) pairs concurrently, yielding it in the given order."""
+    return bounded_map(lambda entry: get_file_metadata(*entry), entries, HASH_WORKERS, HASH_QUEUE_DEPTH)
+
+def get_file_metadata(path: Path, stats: os.stat_result | None = None, previous: FileRecord | None = None,
+                      hash_cache: Dict | None = None, force_hash: bool = False) -> FileRecord:
     """Retrieve metadata for a given file path."""
     
-    #retrieve file metadata 
-    stats = path.stat()
-    filename = path.name
+    #retrieve file metadata (callers that already did a stat can pass it in)
+    if stats is None:
+        stats = path.stat()
 
     #get size in bytes
     size = stats.st_size
@@ -46,108 +274,293 @@ def get_file_metadata(path: Path) -> Dict:
     #get human-readable file mode
     perm_str = stat.filemode(stats.st_mode)
 
-    #get owner name 
-    owner_name = pwd.getpwuid(stats.st_uid).pw_name
-
-    #get group name
-    group_name = grp.getgrgid(stats.st_gid).gr_name
-
-    #get time created as human-readable string
-    ctime_ts = stats.st_ctime
-    ctime_dt = datetime.fromtimestamp(ctime_ts)
-    ctime_iso = ctime_dt.isoformat(timespec='seconds')
-
-    #get last modified time as human-readable string
-    mtime_ts = stats.st_mtime
-    mtime_dt = datetime.fromtimestamp(mtime_ts)
-    mtime_iso = mtime_dt.isoformat(timespec='seconds')
-
-    #calculate file hash and timestamp
-    hash_value = calculate_hash(path)
-    hash_time_dt = datetime.now()
-    hash_time_ts = hash_time_dt.timestamp()
-    hash_time_iso = hash_time_dt.isoformat(timespec='seconds')
-
-    return {
-        "filename": filename,
-        "path": str(path),
-        "owner": owner_name,
-        "group": group_name,
-        "permissions": perm_str,
-        "size": size,
-        "created_ts": ctime_ts,
-        "created": ctime_iso,
-        "last_modified_ts": mtime_ts,
-        "last_modified": mtime_iso,
-        "hash_algorithm": HASH_ALGORITHM,
-        "hash_value": hash_value if hash_value else "UNREADABLE",
-        "last_hash_ts": hash_time_ts,
-        "last_hash": hash_time_iso,
-    }
-
-def scan_once(monitored_files: List[Dict]) -> List[str]:
-    """Perform a single scan of the monitored files, updating their metadata and recording the changes."""
-
-    events: List[str] = []
-
-    for file_info in monitored_files:
-        path = Path(file_info["path"])
+    #get owner name (cached, falls back to the uid when it does not resolve)
+    owner_name = owner_names.name(stats.st_uid)
+
+    #get group name (cached, falls back to the gid when it does not resolve)
+    group_name = group_names.name(stats.st_gid)
+
+    fingerprint = get_fingerprint(stats)
+
+    #reuse the stored hash if the fingerprint did not change since it was calculated
+    merkle = previous.merkle if previous is not None else None
+    if not needs_hash(previous, fingerprint, force_hash):
+        hash_algorithm = previous.hash_algorithm
+        digest = previous.digest
+        hash_time_ts = previous.last_hash_ts
+    else:
+        #hardlinks share the same (dev, ino) so the content is only hashed once per pass
+        if hash_cache is not None and fingerprint in hash_cache:
+            digests = hash_cache[fingerprint]
+        elif uses_blocks(size):
+            #large files get a block tree, the hash value is its root
+            update = update_tree(path, merkle, hash_algorithms(previous, size), force_hash, drop_cache=DROP_CACHE_AFTER_HASH)
+            digests = update.roots if update else None
+            merkle = update.tree if update else None
+            if hash_cache is not None:
+                hash_cache[fingerprint] = digests
+        else:
+            digests = calculate_hashes(path, hash_algorithms(previous, size))
+            merkle = None
+            if hash_cache is not None:
+                hash_cache[fingerprint] = digests
+        hash_algorithm = hash_algorithm_for(size)
+        digest = bytes.fromhex(digests[hash_algorithm]) if digests else UNREADABLE
+        hash_time_ts = time.time()
+        if not digests:
+            #no fingerprint for a hash that failed, so it is tried again on the next pass
+            fingerprint = None
+
+    #timestamps stay numeric, the ISO strings are only formatted when the record is displayed or saved
+    return FileRecord(str(path), owner_name, group_name, perm_str, size, stats.st_ctime, stats.st_mtime,
+                      hash_algorithm, digest, hash_time_ts, fingerprint, merkle)
+
+def log_event(event: Event) -> None:
+    """Log a detected event (missing and created files as warnings, other changes as info)."""
+    if event.type is EventType.MISSING or event.type is EventType.CREATED:
+        logger.warning("%s", event)
+    else:
+        logger.info("%s", event)
+
+def scan_once(monitored_files: List[FileRecord], full_rehash: bool = False, scan_stats: ScanStats | None = None,
+              debounce: Debouncer | None = None) -> List[Event]:
+    """Perform a single scan of the monitored files, updating their metadata and recording the changes.
+
+    Phase timings and counters are added to scan_stats when given. With a debouncer (kept across passes),
+    files that are still in motion are skipped until they settle and then reported with one COALESCED event.
+    """
+
+    events: List[Event] = []
+    scan_stats = scan_stats if scan_stats is not None else ScanStats()
+
+    now = time.time()
+    if debounce is not None:
+        debounce.expire(now)
+
+    #stat every file first (the stat is reused for the metadata) and work out which ones need hashing.
+    #compared holds the records of the checks, (path, stat, force hash, in motion) each
+    compared: List[FileRecord] = []
+    checks: List[Tuple[Path, os.stat_result | None, bool, bool]] = []
+    to_hash: Dict[Tuple, Tuple[Path, List[str]]] = {}
+    to_hash_blocks: Dict[Tuple, Tuple[Path, Dict | None, List[str], bool, bool]] = {}
+    to_sample: Dict[Tuple, Tuple[Path, Dict | None, List[str], bool, bool]] = {}
+    skipped = 0
+    with scan_stats.phase("stat"):
+        for file_info in monitored_files:
+            path = Path(file_info.path)
+            try:
+                stats = path.stat()
+            except FileNotFoundError:
+                if debounce is not None:
+                    debounce.forget(file_info.path)
+                compared.append(file_info)
+                checks.append((path, None, False, False))
+                continue
+
+            force_hash = full_rehash or rehash_due(file_info, now)
+            fingerprint = get_fingerprint(stats)
+            if debounce is not None and debounce.defer(file_info, fingerprint, now):
+                #still being written: not hashed in this pass, only its owner, group and permissions are compared
+                skipped += 1
+                compared.append(file_info)
+                checks.append((path, stats, False, True))
+                continue
+            size = stats.st_size
+            if needs_hash(file_info, fingerprint, force_hash):
+                if uses_blocks(size):
+                    #large files: only the blocks that need it are read
+                    to_hash_blocks.setdefault(fingerprint, (path, file_info.merkle, hash_algorithms(file_info, size), force_hash, False))
+                else:
+                    #hardlinks share the same fingerprint so they are only queued once
+                    _, algorithms = to_hash.setdefault(fingerprint, (path, []))
+                    algorithms.extend(a for a in hash_algorithms(file_info, size) if a not in algorithms)
+            else:
+                skipped += 1
+                #unchanged large files get a few random blocks verified now and then (all of them if one differs)
+                if uses_blocks(size) and samples(file_info.merkle, now):
+                    to_sample.setdefault(fingerprint, (path, file_info.merkle, hash_algorithms(file_info, size), False, True))
+            compared.append(file_info)
+            checks.append((path, stats, force_hash, False))
+
+    scan_stats.files_scanned += len(monitored_files)
+    scan_stats.hashes_skipped += skipped
+    scan_stats.files_hashed += len(to_hash) + len(to_hash_blocks)
+    scan_stats.bytes_hashed += sum(key[2] for key in to_hash)
+
+    #hash the changed files concurrently, within the scan's I/O budget
+    with scan_stats.phase("hash"):
+        hash_cache = hash_files(to_hash, get_scan_budget())
+        block_updates = hash_file_blocks({**to_sample, **to_hash_blocks}, get_scan_budget())
+        for key, update in block_updates.items():
+            hash_cache[key] = update.roots if update else None
+    scan_stats.bytes_hashed += sum(update.bytes_read for update in block_updates.values() if update)
+
+    #owner/group lookups happen while comparing, they are reported as their own phase
+    nss_before = owner_names.lookup_seconds + group_names.lookup_seconds
+    with scan_stats.phase("compare"):
+        _compare(compared, checks, hash_cache, block_updates, events, debounce)
+    nss = owner_names.lookup_seconds + group_names.lookup_seconds - nss_before
+    scan_stats.phases["nss"] += nss
+    scan_stats.phases["compare"] -= nss
+
+    scan_stats.count_events(events)
+    return events
+
+def _compare_access(file_info: FileRecord, path: Path, owner: str, group: str, permissions: str,
+                    events: List[Event]) -> None:
+    """Compare the owner, group and permissions of a file with its record, updating it and appending the events."""
+    if file_info.owner != owner:
+        events.append(Event(EventType.OWNER_CHANGED, str(path), file_info.owner, owner))
+        file_info.owner = owner
+
+    if file_info.group != group:
+        events.append(Event(EventType.GROUP_CHANGED, str(path), file_info.group, group))
+        file_info.group = group
+
+    if file_info.permissions != permissions:
+        events.append(Event(EventType.PERMISSIONS_CHANGED, str(path), file_info.permissions, permissions))
+        file_info.permissions = permissions
+
+def _compare(monitored_files: List[FileRecord], checks: List[Tuple[Path, os.stat_result | None, bool, bool]],
+             hash_cache: Dict, block_updates: Dict[Tuple, BlockUpdate | None], events: List[Event],
+             debounce: Debouncer | None = None) -> None:
+    """Compare the current metadata with the stored records, updating them and appending the events."""
+
+    #compare in the original order so the events are deterministic
+    for file_info, (path, stats, force_hash, in_motion) in zip(monitored_files, checks):
+        start = len(events)
 
         #check existence
-        if not path.exists():
-            msg = f"[MISSING] {path} does not exist."
-            events.append(msg)
-            logger.warning(msg)
+        if stats is None:
+            event = Event(EventType.MISSING, str(path))
+            events.append(event)
+            log_event(event)
+            continue
+
+        #a file in motion: access changes are never deferred (the content, size and mtime are once it settles)
+        if in_motion:
+            _compare_access(file_info, path, owner_names.name(stats.st_uid), group_names.name(stats.st_gid),
+                            stat.filemode(stats.st_mode), events)
+            for event in events[start:]:
+                log_event(event)
             continue
 
-        current_info = get_file_metadata(path)
+        #a sample check that found a changed block hashed the whole file: use its new root
+        update = block_updates.get(get_fingerprint(stats))
+        if update is not None and update.changed:
+            force_hash = True
+        current_info = get_file_metadata(path, stats, file_info, hash_cache, force_hash)
 
-        #print("DEBUG:", path.name, "old size:", file_info["size"], "new size:", current_info["size"])
+        #deleted between the stat and the hash: missing, like a file that was gone before the stat
+        if current_info.digest == UNREADABLE and not path.exists():
+            if debounce is not None:
+                debounce.forget(file_info.path)
+            event = Event(EventType.MISSING, str(path))
+            events.append(event)
+            log_event(event)
+            continue
+
+        #print("DEBUG:", path.name, "old size:", file_info.size, "new size:", current_info.size)
 
         #compare and log changes for each monitored attribute + add to events list
 
-        if file_info["owner"] != current_info["owner"]:
-            msg = f"[OWNER_CHANGED] {path.name} owner changed from {file_info['owner']} -> {current_info['owner']}."
-            events.append(msg)
-            logger.info(msg)
-            file_info["owner"] = current_info["owner"]
-
-        if file_info["group"] != current_info["group"]:
-            msg = f"[GROUP_CHANGED] {path.name} group changed from {file_info['group']} -> {current_info['group']}."
-            events.append(msg)
-            logger.info(msg)
-            file_info["group"] = current_info["group"]
-        
-        if file_info["permissions"] != current_info["permissions"]:
-            msg = f"[PERMISSIONS_CHANGED] {path.name} permissions changed from {file_info['permissions']} -> {current_info['permissions']}."
-            events.append(msg)
-            logger.info(msg)
-            file_info["permissions"] = current_info["permissions"]
-        
-        if file_info["size"] != current_info["size"]:
-            msg = f"[SIZE_CHANGED] {path.name} size changed from {file_info['size']} -> {current_info['size']}."
-            events.append(msg)
-            logger.info(msg)
-            file_info["size"] = current_info["size"]
+        _compare_access(file_info, path, current_info.owner, current_info.group, current_info.permissions, events)
+
+        if file_info.size != current_info.size:
+            event = Event(EventType.SIZE_CHANGED, str(path), file_info.size, current_info.size)
+            events.append(event)
+            file_info.size = current_info.size
         
-        if file_info["last_modified_ts"] != current_info["last_modified_ts"]:
-            msg = f"[MODIFIED] {path.name} last modified time changed from {file_info['last_modified']} -> {current_info['last_modified']}."
-            events.append(msg)
-            logger.info(msg)
-            file_info["last_modified_ts"] = current_info["last_modified_ts"]
-            file_info["last_modified"] = current_info["last_modified"]
-
-        if file_info["hash_value"] != current_info["hash_value"]:
-            msg = f"[HASH_CHANGED] {path.name} hash value changed."
-            events.append(msg)
-            logger.info(msg)
-            file_info["hash_value"] = current_info["hash_value"]
-            
-        file_info["last_hash_ts"] = current_info["last_hash_ts"]
-        file_info["last_hash"] = current_info["last_hash"]
-
-       
+        if file_info.last_modified_ts != current_info.last_modified_ts:
+            event = Event(EventType.MODIFIED, str(path), file_info.last_modified_ts, current_info.last_modified_ts)
+            events.append(event)
+            file_info.last_modified_ts = current_info.last_modified_ts
 
-    return events
+        #a baseline moving to a new algorithm is compared with a digest in the algorithm it was stored with
+        current_digest = current_info.digest
+        if file_info.hash_algorithm != current_info.hash_algorithm:
+            digests = hash_cache.get(current_info.fingerprint)
+            current_digest = bytes.fromhex(digests[file_info.hash_algorithm]) \
+                if digests and file_info.hash_algorithm in digests else current_info.digest
+
+        #block-hashed files report what changed: an append (earlier content verified) or the changed byte ranges
+        if file_info.digest != current_digest:
+            if update is not None and update.appended and not update.changed:
+                event = Event(EventType.APPENDED, str(path), *update.appended)
+            elif update is not None and update.changed:
+                event = Event(EventType.BLOCKS_CHANGED, str(path), file_info.hash_value, update.changed)
+            else:
+                current_hash = current_digest.hex() if isinstance(current_digest, bytes) else current_digest
+                event = Event(EventType.HASH_CHANGED, str(path), file_info.hash_value, current_hash)
+            events.append(event)
+
+        if update is not None:
+            file_info.merkle = update.tree
+        elif current_info.last_hash_ts != file_info.last_hash_ts:
+            #rehashed as a whole (e.g. the file shrank below the block hashing size)
+            file_info.merkle = None
+        file_info.digest = current_info.digest
+        file_info.hash_algorithm = current_info.hash_algorithm
+        file_info.last_hash_ts = current_info.last_hash_ts
+        file_info.fingerprint = current_info.fingerprint
 
+        #a file that was in motion gets one event for everything that changed while it was
+        if debounce is not None:
+            events[start:] = debounce.coalesce(file_info.path, events[start:])
+        for event in events[start:]:
+            log_event(event)
 
+
+def watch_root(directory: Path, recursive: bool, workers: int = 1,
+               **walk_options) -> Tuple[Dict, List[Tuple[Path, os.stat_result]]]:
+    """Register a directory as a watched root. Returns the root record and the (path, stat) of its files."""
+    root = {"path": str(directory), "recursive": recursive, "options": walk_options, "dirs": {}}
+    entries = list(walk_files(directory, recursive, workers=workers, dir_mtimes=root["dirs"], **walk_options))
+    return root, entries
+
+def scan_roots(roots: Dict[str, Dict], monitored_files: List[FileRecord],
+               is_known: Callable[[str], bool] | None = None) -> List[Event]:
+    """Re-list only the directories of watched roots whose mtime changed and start monitoring new files.
+
+    New files are appended to monitored_files. is_known checks paths that are monitored but not in the list
+    (e.g. a storage lookup when the baseline is not loaded).
+    """
+
+    events: List[Event] = []
+    known = {f.path for f in monitored_files}
+
+    for root in roots.values():
+        dirs: Dict[str, int] = root["dirs"]
+        options = root["options"]
+        max_depth = options.get("max_depth")
+
+        #a directory's mtime changes when entries are created, deleted or renamed directly inside it
+        changed = []
+        for directory, mtime in list(dirs.items()):
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                #files that were inside are reported as missing by scan_once
+                del dirs[directory]
+                continue
+            if current != mtime:
+                changed.append(directory)
+
+        new_entries = []
+        for directory in changed:
+            #list the changed directory itself and only enter subdirectories that are not known yet
+            depth = 0 if directory == root["path"] else directory[len(root["path"]):].count(os.sep)
+            walk = dict(options, max_depth=None if max_depth is None else max(0, max_depth - depth))
+            entries = walk_files(Path(directory), root["recursive"], base=Path(root["path"]),
+                                 dir_mtimes=dirs, skip_dirs=set(dirs), **walk)
+            new_entries.extend(entry for entry in entries
+                               if str(entry[0]) not in known and not (is_known is not None and is_known(str(entry[0]))))
+
+        for file_info in collect_metadata(new_entries):
+            monitored_files.append(file_info)
+            known.add(file_info.path)
+            event = Event(EventType.CREATED, file_info.path)
+            events.append(event)
+            log_event(event)
+
+    return events
@@ -1,8 +1,17 @@
 from __future__ import annotations
 from pathlib import Path
+import argparse
+import errno
+import glob
 import os
 import stat
+import sys
 import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Tuple, TypeVar
+from src.utils import matches_patterns
+
+R = TypeVar("R")
 
 logger = logging.getLogger(__name__)
 
@@ -48,42 +57,41 @@ def get_permission_octal(path: Path) -> str:
     """Get the file permissions in octal format."""
 
     mode = path.stat().st_mode
+    return _octal(mode)
+
+def _octal(mode: int) -> str:
     # keep special bits and format in 4 digits
     perm_octal = mode & 0o7777
     return format(perm_octal, "04o")
 
-#set file permissions using octal string
-def set_permissions_octal(path: Path, perm_octal: str) -> None:
-    """Set the file permissions using an octal string."""
-    
+def _parse_octal(perm_octal: str) -> int:
+    """Parse an octal permission string like "0644"."""
     perm_octal = perm_octal.strip()
 
     if not perm_octal:
         raise ValueError("Permission octal string cannot be empty.")
     
     try:
-        perm_int = int(perm_octal, 8)
+        return int(perm_octal, 8)
     except ValueError:
         raise ValueError(f"Invalid octal permission string: {perm_octal}")
+
+#set file permissions using octal string
+def set_permissions_octal(path: Path, perm_octal: str) -> None:
+    """Set the file permissions using an octal string."""
     
+    perm_int = _parse_octal(perm_octal)
     path.chmod(perm_int)
 
-    logger.info(f"Set permissions of {path} to {perm_octal}.")
+    logger.info(f"Set permissions of {path} to {perm_octal.strip()}.")
 
-#add/remove specific permissions
-def modify_permission(path: Path, entity: str, perms: list[str], action: str) -> None:
-    """Modify specific permissions for user, group, or others."""
-
-    entity = entity.lower()
-    action = action.lower()
-    perms = [p.lower() for p in perms]
+def _apply_permission_bits(mode: int, entity: str, perms: list[str], action: str) -> int:
+    """Return mode with the permissions of an entity added or removed."""
 
     #check if entity is valid
     if entity not in PERM_BITS:
         raise ValueError(f"Invalid entity: {entity}. Must be 'user', 'group', 'others', 'all', 'special'.")
 
-    mode = path.stat().st_mode
-
     #check if permissions are valid and modify mode accordingly
     for perm in perms:
         if perm not in PERM_BITS[entity]:
@@ -97,7 +105,298 @@ def modify_permission(path: Path, entity: str, perms: list[str], action: str) ->
             mode &= ~perm_bit
         else:
             raise ValueError(f"Invalid action: {action}. Must be 'add' or 'remove'.")
+    return mode
+
+#add/remove specific permissions
+def modify_permission(path: Path, entity: str, perms: list[str], action: str) -> None:
+    """Modify specific permissions for user, group, or others."""
+
+    entity = entity.lower()
+    action = action.lower()
+    perms = [p.lower() for p in perms]
 
+    mode = _apply_permission_bits(path.stat().st_mode, entity, perms, action)
     path.chmod(mode)
 
-    logger.info(f"Modified permissions of {path}: {action} {perms} for {entity}.")
\ No newline at end of file
+    logger.info(f"Modified permissions of {path}: {action} {perms} for {entity}.")
+
+
+#bulk operations over a directory tree (or every match of a glob)
+
+#number of directories processed in parallel by the bulk operations (1 walks the tree in the calling thread)
+BULK_WORKERS: int = min(4, os.cpu_count() or 1)
+
+#directories are opened relative to their parent and never through a symlink
+_DIR_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC
+
+def _chmod_at(dir_fd: int, name: str, mode: int) -> None:
+    """chmod an entry relative to its directory without following a symlink swapped in since it was listed.
+
+    (os.chmod(follow_symlinks=False) is not supported on Linux, so the entry is opened with O_NOFOLLOW.)
+    """
+    try:
+        fd = os.open(name, os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK | os.O_CLOEXEC, dir_fd=dir_fd)
+    except PermissionError:
+        if not hasattr(os, "O_PATH"):
+            raise
+        #not readable: an O_PATH descriptor needs no read access, and the entry is changed through it
+        #(an O_PATH descriptor cannot be fchmod'ed, its /proc/self/fd link can be chmod'ed)
+        fd = os.open(name, os.O_PATH | os.O_NOFOLLOW | os.O_CLOEXEC, dir_fd=dir_fd)
+        try:
+            if stat.S_ISLNK(os.fstat(fd).st_mode):
+                raise OSError(errno.ELOOP, "replaced by a symlink", name)
+            os.chmod(f"/proc/self/fd/{fd}", mode)
+        finally:
+            os.close(fd)
+        return
+    try:
+        os.fchmod(fd, mode)
+    finally:
+        os.close(fd)
+
+class SweepResult(list):
+    """Results of a bulk operation (a list sorted by path) plus the entries that could not be checked.
+
+    errors holds (path, reason) pairs. The sweep is complete only when it is empty.
+    """
+
+    def __init__(self, results=(), errors: List[Tuple[str, str]] | None = None) -> None:
+        super().__init__(results)
+        self.errors: List[Tuple[str, str]] = errors if errors is not None else []
+
+    @property
+    def complete(self) -> bool:
+        return not self.errors
+
+def _walk_tree(target: str, visit: Callable[[int, str, str, os.stat_result], R | None], recursive: bool = True,
+               include: List[str] | None = None, exclude: List[str] | None = None, include_dirs: bool = False,
+               workers: int = BULK_WORKERS) -> SweepResult:
+    """Call visit(dir_fd, name, path, stat) for every regular file (and directory with include_dirs) of a
+    directory tree or of the matches of a glob, and return the results that are not None sorted by path.
+
+    Symlinks are never followed or visited. With more than one worker every directory is a task of a thread pool.
+    A directory is only opened while its task runs (so the open descriptors are bounded by the workers, not by the
+    size of the tree), and it must still be the directory that was listed. Entries that cannot be checked are
+    logged and returned in the errors of the result.
+    """
+    exclude = exclude or []
+    results: List[R] = []
+    errors: List[Tuple[str, str]] = []
+
+    def wanted(name: str, rel_path: str, is_dir: bool) -> bool:
+        """Entry passes the include patterns (the exclude patterns are checked before)."""
+        return (include_dirs or not is_dir) and (not include or matches_patterns(name, rel_path, include))
+
+    def skip(path: str, reason: str) -> None:
+        logger.warning(f"Skipping {path}: {reason}")
+        errors.append((path, reason))
+
+    def visit_one(dir_fd: int, name: str, path: str, rel_path: str) -> None:
+        st = os.stat(name, dir_fd=dir_fd, follow_symlinks=False)
+        is_dir = stat.S_ISDIR(st.st_mode)
+        if (is_dir or stat.S_ISREG(st.st_mode)) and not (exclude and matches_patterns(name, rel_path, exclude)) \
+                and wanted(name, rel_path, is_dir):
+            result = visit(dir_fd, name, path, st)
+            if result is not None:
+                results.append(result)
+
+    def process(dir_path: str, prefix_len: int, dev: int, ino: int) -> List[Tuple[str, int, int, int]]:
+        subdirs = []
+        try:
+            dir_fd = os.open(dir_path, _DIR_FLAGS)
+        except OSError as exc:
+            skip(dir_path, f"cannot open: {exc.strerror or exc}")
+            return subdirs
+        try:
+            #a directory (or a parent of it) replaced by a symlink since it was listed is not followed
+            st = os.fstat(dir_fd)
+            if (st.st_dev, st.st_ino) != (dev, ino):
+                skip(dir_path, "replaced since it was listed")
+                return subdirs
+            with os.scandir(dir_fd) as entries:
+                for entry in entries:
+                    name = entry.name
+                    path = os.path.join(dir_path, name)
+                    rel_path = path[prefix_len:]
+                    try:
+                        if entry.is_symlink() or (exclude and matches_patterns(name, rel_path, exclude)):
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                        is_dir = stat.S_ISDIR(st.st_mode)
+                        if (is_dir or stat.S_ISREG(st.st_mode)) and wanted(name, rel_path, is_dir):
+                            result = visit(dir_fd, name, path, st)
+                            if result is not None:
+                                results.append(result)
+                        if is_dir and recursive:
+                            subdirs.append((path, prefix_len, st.st_dev, st.st_ino))
+                    except OSError as exc:
+                        skip(path, exc.strerror or str(exc))
+        except OSError as exc:
+            skip(dir_path, f"cannot list: {exc.strerror or exc}")
+        finally:
+            os.close(dir_fd)
+        return subdirs
+
+    #a glob expands to several roots, a plain path is one root
+    roots = sorted(glob.glob(target)) if any(c in target for c in "*?[") else [target]
+    tasks = []
+    for root in roots:
+        root = os.path.abspath(root)
+        parent, name = os.path.split(root)
+        try:
+            parent_fd = os.open(parent, _DIR_FLAGS)
+            try:
+                #the root itself (a file matched by the glob, or the directory with include_dirs)
+                visit_one(parent_fd, name, root, name)
+                st = os.stat(name, dir_fd=parent_fd, follow_symlinks=False)
+                if stat.S_ISDIR(st.st_mode):
+                    tasks.append((root, len(root) + 1, st.st_dev, st.st_ino))
+            finally:
+                os.close(parent_fd)
+        except OSError as exc:
+            #a root that cannot be walked fails the sweep, named by its full path rather than relative to its parent
+            exc.filename = root
+            raise
+
+    if workers <= 1:
+        while tasks:
+            tasks.extend(process(*tasks.pop()))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {executor.submit(process, *task) for task in tasks}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.update(executor.submit(process, *task) for task in future.result())
+
+    results.sort(key=lambda result: result[0] if isinstance(result, tuple) else result["path"])
+    errors.sort()
+    return SweepResult(results, errors)
+
+def _bulk_chmod(target: str, new_mode: Callable[[int], int], dry_run: bool, **walk_options) -> SweepResult:
+    """Apply new_mode to the permissions of every entry. Returns (path, old octal, new octal) for the ones that change."""
+
+    def visit(dir_fd: int, name: str, path: str, st: os.stat_result) -> Tuple[str, str, str] | None:
+        mode = new_mode(stat.S_IMODE(st.st_mode))
+        if mode == stat.S_IMODE(st.st_mode):
+            return None
+        if not dry_run:
+            _chmod_at(dir_fd, name, mode)
+        return path, _octal(st.st_mode), _octal(mode)
+
+    changes = _walk_tree(target, visit, **walk_options)
+    if not dry_run:
+        logger.info(f"Changed permissions of {len(changes)} entries under {target}.")
+    if not changes.complete:
+        logger.warning(f"{len(changes.errors)} entries under {target} could not be checked.")
+    return changes
+
+def bulk_modify_permission(target: str, entity: str, perms: list[str], action: str, dry_run: bool = False,
+                           **walk_options) -> SweepResult:
+    """modify_permission for every file of a directory tree or glob.
+
+    walk_options: recursive, include/exclude glob patterns, include_dirs (change directories too) and workers.
+    With dry_run nothing is changed. Returns (path, old octal, new octal) of every entry that changes, with
+    the entries that could not be checked or changed in its errors.
+    """
+    entity = entity.lower()
+    action = action.lower()
+    perms = [p.lower() for p in perms]
+
+    #validate before touching anything
+    _apply_permission_bits(0, entity, perms, action)
+    return _bulk_chmod(target, lambda mode: _apply_permission_bits(mode, entity, perms, action), dry_run, **walk_options)
+
+def bulk_set_permissions_octal(target: str, perm_octal: str, dry_run: bool = False,
+                               **walk_options) -> SweepResult:
+    """set_permissions_octal for every file of a directory tree or glob (see bulk_modify_permission)."""
+    perm_int = _parse_octal(perm_octal)
+    return _bulk_chmod(target, lambda mode: perm_int, dry_run, **walk_options)
+
+def audit_permissions(target: str, **walk_options) -> SweepResult:
+    """Find world-writable entries and files with the SUID, SGID or sticky bit in a directory tree or glob.
+
+    World-writable directories are only reported without the sticky bit (like /tmp they are fine with it).
+    Returns one finding per entry with its path, octal and string permissions and the issues found, with the
+    entries that could not be checked in its errors (the audit is incomplete if there are any).
+    """
+    others_write = PERM_BITS["others"]["write"]
+    special = PERM_BITS["special"]
+
+    def visit(dir_fd: int, name: str, path: str, st: os.stat_result) -> Dict | None:
+        mode = st.st_mode
+        issues = []
+        if stat.S_ISDIR(mode):
+            if mode & others_write and not mode & special["sticky"]:
+                issues.append("world-writable")
+        else:
+            if mode & others_write:
+                issues.append("world-writable")
+            issues.extend(bit_name for bit_name, bit in special.items() if mode & bit)
+        if not issues:
+            return None
+        return {"path": path, "octal": _octal(mode), "permissions": stat.filemode(mode), "issues": issues}
+
+    walk_options.setdefault("include_dirs", True)
+    return _walk_tree(target, visit, **walk_options)
+
+
+def main() -> int:
+    """Command line: bulk permission changes and the permission audit."""
+    parser = argparse.ArgumentParser(description="Change or audit the permissions of a directory tree or glob.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    chmod = sub.add_parser("chmod", help="change permissions of every file")
+    chmod.add_argument("target", help="directory, file or glob (quote it)")
+    change = chmod.add_mutually_exclusive_group(required=True)
+    change.add_argument("--set", metavar="OCTAL", help="set the permissions, e.g. 0644")
+    change.add_argument("--add", metavar="PERMS", help="comma separated permissions to add to --entity")
+    change.add_argument("--remove", metavar="PERMS", help="comma separated permissions to remove from --entity")
+    chmod.add_argument("--entity", default="all", choices=sorted(PERM_BITS))
+    chmod.add_argument("--dirs", action="store_true", help="change directories too")
+    chmod.add_argument("--dry-run", action="store_true")
+    audit = sub.add_parser("audit", help="report world-writable, SUID, SGID and sticky entries")
+    audit.add_argument("target", help="directory, file or glob (quote it)")
+    for command in (chmod, audit):
+        command.add_argument("--no-recursive", dest="recursive", action="store_false")
+        command.add_argument("--include", action="append", help="glob pattern, can be repeated")
+        command.add_argument("--exclude", action="append", help="glob pattern, can be repeated")
+        command.add_argument("--workers", type=int, default=BULK_WORKERS)
+    args = parser.parse_args()
+
+    try:
+        return _run(args)
+    except (OSError, ValueError) as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+
+def _run(args: argparse.Namespace) -> int:
+    walk_options = {"recursive": args.recursive, "include": args.include, "exclude": args.exclude, "workers": args.workers}
+    if args.cmd == "audit":
+        findings = audit_permissions(args.target, **walk_options)
+        for finding in findings:
+            print(f"{finding['octal']} {finding['permissions']} {finding['path']}: {', '.join(finding['issues'])}")
+        return _report_errors(findings)
+
+    walk_options["include_dirs"] = args.dirs
+    if args.set:
+        changes = bulk_set_permissions_octal(args.target, args.set, args.dry_run, **walk_options)
+    else:
+        action = "add" if args.add else "remove"
+        perms = [p.strip() for p in (args.add or args.remove).split(",")]
+        changes = bulk_modify_permission(args.target, args.entity, perms, action, args.dry_run, **walk_options)
+    for path, old, new in changes:
+        print(f"{old} -> {new} {path}")
+    print(f"{'Would change' if args.dry_run else 'Changed'} {len(changes)} entries.")
+    return _report_errors(changes)
+
+def _report_errors(sweep: SweepResult) -> int:
+    """Print the entries a sweep could not check. Exit status 1 if it is incomplete."""
+    for path, reason in sweep.errors:
+        print(f"Skipped {path}: {reason}", file=sys.stderr)
+    if sweep.complete:
+        return 0
+    print(f"Incomplete: {len(sweep.errors)} entries could not be checked.", file=sys.stderr)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#src/pipeline.py
+from __future__ import annotations
+import json
+import logging
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+from src import shards, storage
+from src.events import Event
+from src.metrics import ScanStats
+from src.monitor import scan_roots
+from src.records import FileRecord
+from src.utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+#files scanned and written back per chunk. only one chunk of records (and its events) is in memory at a time.
+#when scans are sharded over several processes, chunks have at least SHARD_THRESHOLD files so each one is sharded
+SCAN_CHUNK_SIZE: int = 10_000
+
+#progress of the running pass, written after every chunk. an interrupted pass resumes after the last path in it
+CHECKPOINT_FILE = Path("data") / "scan_checkpoint.json"
+
+
+def read_records(after: str | None = None, batch: int = storage.EXPORT_BATCH) -> Iterator[FileRecord]:
+    """Stage 1: stream the monitored files from storage in path order."""
+    return storage.iter_files(batch, after)
+
+def chunks(records: Iterable[FileRecord], size: int) -> Iterator[List[FileRecord]]:
+    """Group the record stream into lists of size records."""
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+def scan_chunks(chunk_stream: Iterable[List[FileRecord]], full_rehash: bool,
+                scan_stats: ScanStats) -> Iterator[Tuple[List[FileRecord], List[FileRecord], List[Event]]]:
+    """Stage 2: stat, hash and compare every chunk (scan_files, so large chunks are sharded).
+
+    Yields (chunk, the records that changed, events). Events are logged while they are found.
+    """
+    for chunk in chunk_stream:
+        before = [(f.state(), f.merkle) for f in chunk]
+        events = shards.scan_files(chunk, full_rehash, scan_stats)
+        changed = [f for f, old in zip(chunk, before) if (f.state(), f.merkle) != old]
+        yield chunk, changed, events
+
+def write_back(results: Iterable[Tuple[List[FileRecord], List[FileRecord], List[Event]]], checkpoint: Dict,
+               scan_stats: ScanStats, checkpoint_file: Path = CHECKPOINT_FILE) -> Iterator[Event]:
+    """Stage 3: write the changed records of every chunk back, then move the checkpoint past the chunk."""
+    for chunk, changed, events in results:
+        with scan_stats.phase("save"):
+            if changed:
+                storage.update_files(changed)
+            checkpoint["after"] = chunk[-1].path
+            checkpoint["files"] += len(chunk)
+            checkpoint["events"] += len(events)
+            save_checkpoint(checkpoint, checkpoint_file)
+        yield from events
+
+
+def load_checkpoint(checkpoint_file: Path = CHECKPOINT_FILE) -> Dict | None:
+    """Checkpoint of an interrupted pass, or None."""
+    try:
+        return json.loads(checkpoint_file.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def save_checkpoint(checkpoint: Dict, checkpoint_file: Path = CHECKPOINT_FILE) -> None:
+    """Write the checkpoint atomically so an interrupted write never leaves a broken one."""
+    checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(checkpoint_file) as tmp_file:
+        tmp_file.write_text(json.dumps(checkpoint), encoding="utf-8")
+
+def stream_scan(full_rehash: bool = False, scan_stats: ScanStats | None = None, chunk_size: int | None = None,
+                resume: bool = True, checkpoint_file: Path = CHECKPOINT_FILE) -> Iterator[Event]:
+    """Scan the stored baseline as a pipeline (read records -> stat/hash/compare -> write back) and yield the
+    events while the pass runs.
+
+    Memory is bounded by one chunk. After every chunk its changes are stored and the checkpoint moves on, so a pass
+    that is interrupted resumes after the last finished chunk (with resume) instead of starting over. The checkpoint
+    is removed when the pass completes.
+    """
+    scan_stats = scan_stats if scan_stats is not None else ScanStats()
+    if chunk_size is None:
+        chunk_size = max(SCAN_CHUNK_SIZE, shards.SHARD_THRESHOLD) if shards.SHARD_COUNT > 1 else SCAN_CHUNK_SIZE
+
+    checkpoint = load_checkpoint(checkpoint_file) if resume else None
+    if checkpoint is not None and checkpoint.get("full_rehash") == full_rehash:
+        logger.info(f"Resuming the scan started at {time.ctime(checkpoint['started'])} after {checkpoint['files']} files.")
+    else:
+        checkpoint = {"started": time.time(), "full_rehash": full_rehash, "after": None, "files": 0, "events": 0}
+
+    #watched roots first: new files are stored and then scanned with the rest
+    roots = storage.load_roots()
+    if roots:
+        new_files: List[FileRecord] = []
+        with scan_stats.phase("roots"):
+            events = scan_roots(roots, new_files, storage.has_file)
+            storage.add_files(new_files)
+            storage.save_roots(roots)
+        scan_stats.count_events(events)
+        yield from events
+
+    batch = storage.EXPORT_BATCH
+    if isinstance(storage.get_backend(), storage.JsonBackend):
+        #the JSON backend reads and rewrites its whole file for every batch and write back,
+        #so the baseline is read in one batch and scanned as one chunk: the file is written once per pass
+        chunk_size = batch = max(1, storage.count_files())
+
+    results = scan_chunks(chunks(read_records(checkpoint["after"], batch), chunk_size), full_rehash, scan_stats)
+    yield from write_back(results, checkpoint, scan_stats, checkpoint_file)
+
+    checkpoint_file.unlink(missing_ok=True)
@@ -0,0 +1,124 @@
+#src/records.py
+from __future__ import annotations
+import os
+import sys
+from datetime import datetime
+from typing import Any, Dict, Tuple
+
+#hash_value of a file that could not be read
+UNREADABLE = "UNREADABLE"
+
+#keys of the JSON form, in the order they are written
+FIELDS = ("filename", "path", "owner", "group", "permissions", "size", "created_ts", "created", "last_modified_ts",
+          "last_modified", "hash_algorithm", "hash_value", "last_hash_ts", "last_hash", "fingerprint")
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts).isoformat(timespec='seconds')
+
+def _to_digest(hash_value: str) -> bytes | str:
+    """Hex digests are kept as bytes (half the size), anything else (UNREADABLE) as is."""
+    try:
+        return bytes.fromhex(hash_value)
+    except (TypeError, ValueError):
+        return hash_value
+
+def _to_ts(data: Dict, key: str) -> float:
+    """Numeric timestamp of a JSON record (records without the _ts field only have the ISO string)."""
+    ts = data.get(f"{key}_ts")
+    if ts is None and data.get(key):
+        ts = datetime.fromisoformat(data[key]).timestamp()
+    return ts or 0.0
+
+
+class FileRecord:
+    """Compact in-memory form of a monitored file.
+
+    Timestamps are kept as numbers, the digest as bytes and owner/group/permissions as interned strings.
+    The ISO strings and the file name are formatted when they are asked for, and to_dict()/from_dict()
+    convert from and to the JSON form.
+    """
+
+    __slots__ = ("path", "owner", "group", "permissions", "size", "created_ts", "last_modified_ts",
+                 "hash_algorithm", "digest", "last_hash_ts", "fingerprint", "merkle")
+
+    def __init__(self, path: str, owner: str, group: str, permissions: str, size: int, created_ts: float,
+                 last_modified_ts: float, hash_algorithm: str, digest: bytes | str, last_hash_ts: float,
+                 fingerprint: Tuple[int, ...] | None = None, merkle: Dict | None = None) -> None:
+        self.path = path
+        self.owner = sys.intern(owner)
+        self.group = sys.intern(group)
+        self.permissions = sys.intern(permissions)
+        self.size = size
+        self.created_ts = created_ts
+        self.last_modified_ts = last_modified_ts
+        self.hash_algorithm = sys.intern(hash_algorithm)
+        self.digest = digest
+        self.last_hash_ts = last_hash_ts
+        self.fingerprint = fingerprint
+        self.merkle = merkle
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "FileRecord":
+        """Build a record from its JSON form."""
+        fingerprint = data.get("fingerprint")
+        return cls(
+            data["path"], data["owner"], data["group"], data["permissions"], data["size"],
+            _to_ts(data, "created"), _to_ts(data, "last_modified"), data.get("hash_algorithm", "sha256"),
+            _to_digest(data.get("hash_value", UNREADABLE)), _to_ts(data, "last_hash"),
+            tuple(fingerprint) if fingerprint is not None else None, data.get("merkle"),
+        )
+
+    @property
+    def filename(self) -> str:
+        return os.path.basename(self.path)
+
+    @property
+    def hash_value(self) -> str:
+        return self.digest.hex() if isinstance(self.digest, bytes) else self.digest
+
+    @property
+    def created(self) -> str:
+        return _iso(self.created_ts)
+
+    @property
+    def last_modified(self) -> str:
+        return _iso(self.last_modified_ts)
+
+    @property
+    def last_hash(self) -> str:
+        return _iso(self.last_hash_ts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON form of the record (the same fields as before, the strings are formatted here)."""
+        data = {key: getattr(self, key) for key in FIELDS}
+        if self.fingerprint is not None:
+            data["fingerprint"] = list(self.fingerprint)
+        if self.merkle is not None:
+            data["merkle"] = self.merkle
+        return data
+
+    def state(self) -> Tuple:
+        """Everything stored about the file, to cheaply check if a record changed (the merkle tree follows the digest)."""
+        return (self.path, self.owner, self.group, self.permissions, self.size, self.created_ts, self.last_modified_ts,
+                self.hash_algorithm, self.digest, self.last_hash_ts, self.fingerprint)
+
+    def copy(self) -> "FileRecord":
+        return FileRecord(*self.state(), self.merkle)
+
+    def copy_from(self, other: "FileRecord") -> None:
+        """Take over every field of another record of the file (e.g. one updated in another process)."""
+        for name in self.__slots__:
+            setattr(self, name, getattr(other, name))
+
+    def __repr__(self) -> str:
+        return f"FileRecord({self.path!r}, {self.hash_value[:12]}...)"
+
+
+def to_record(data: "FileRecord | Dict") -> FileRecord:
+    """Accept a record in either form."""
+    return data if isinstance(data, FileRecord) else FileRecord.from_dict(data)
+
+def to_json(data: "FileRecord | Dict") -> Dict:
+    """JSON form of a record in either form."""
+    return data.to_dict() if isinstance(data, FileRecord) else data
@@ -0,0 +1,118 @@
+#src/scheduler.py
+from __future__ import annotations
+import fnmatch
+import heapq
+import json
+import logging
+import math
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+#optional per-pattern scan intervals, e.g. [{"pattern": "/etc/*", "interval": 1}, {"pattern": "/srv/data/*", "interval": 3600}]
+#patterns are matched against the full path (an exact path works as a per-file rule), the first match wins
+SCHEDULE_FILE = Path("data") / "schedule.json"
+
+#length of one scheduler tick in seconds (ticks are shorter when an interval is shorter)
+TICK_INTERVAL: float = 1.0
+
+#shortest scan interval in seconds. shorter ones (0 or negative) are raised to it, a tick of 0 would never end
+MIN_INTERVAL: float = 0.1
+
+
+def _clamp_interval(interval: float, what: str) -> float:
+    """Raise an interval below MIN_INTERVAL to it."""
+    if not interval >= MIN_INTERVAL:
+        logger.warning(f"Scan interval {interval} of {what} is too short, using {MIN_INTERVAL}s.")
+        return MIN_INTERVAL
+    return interval
+
+
+def load_schedule_rules(schedule_file: Path = SCHEDULE_FILE) -> List[Tuple[str, float]]:
+    """Load the (pattern, interval) rules from the schedule file, or no rules if it does not exist."""
+    if not schedule_file.exists():
+        return []
+    with schedule_file.open("r", encoding="utf-8") as f:
+        try:
+            rules = json.load(f)
+        except json.JSONDecodeError:
+            logger.error(f"Invalid schedule file {schedule_file}, using the default interval for all files.")
+            return []
+    return [(rule["pattern"], _clamp_interval(float(rule["interval"]), rule["pattern"])) for rule in rules]
+
+
+class Scheduler:
+    """Priority queue of monitored paths keyed on the time they are next due for a scan."""
+
+    def __init__(self, default_interval: float, rules: Iterable[Tuple[str, float]] = ()) -> None:
+        self.default_interval = _clamp_interval(default_interval, "the default")
+        self.rules = [(pattern, _clamp_interval(interval, pattern)) for pattern, interval in rules]
+        self._queue: List[Tuple[float, str, float]] = []
+        self._active = set()
+
+    @property
+    def tick_interval(self) -> float:
+        """Tick length: TICK_INTERVAL, or the shortest scan interval if that is shorter."""
+        return min([TICK_INTERVAL, self.default_interval] + [interval for _, interval in self.rules])
+
+    def interval_for(self, path: str) -> float:
+        """Scan interval of a path: the first matching rule or the default interval."""
+        for pattern, interval in self.rules:
+            if fnmatch.fnmatch(path, pattern):
+                return interval
+        return self.default_interval
+
+    def add(self, path: str, now: float) -> None:
+        """Schedule a path. Its first scan gets a stable offset inside its interval so the work is spread evenly."""
+        if path in self._active:
+            return
+        interval = self.interval_for(path)
+        phase = (zlib.crc32(path.encode()) % 10000) / 10000 * interval
+        heapq.heappush(self._queue, (now + phase, path, interval))
+        self._active.add(path)
+
+    def remove(self, path: str) -> None:
+        """Stop scheduling a path (its queue entry is dropped when it comes up)."""
+        self._active.discard(path)
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+    def due(self, now: float) -> List[str]:
+        """Pop every path that is due and schedule its next scan at a fixed rate."""
+        paths = []
+        while self._queue and self._queue[0][0] <= now:
+            due_at, path, interval = heapq.heappop(self._queue)
+            if path not in self._active:
+                continue
+            paths.append(path)
+
+            #keep the phase: the next scan is one interval after the previous due time, skipping missed ones
+            next_due = due_at + interval
+            if next_due <= now:
+                next_due += interval * math.ceil((now - next_due) / interval)
+            heapq.heappush(self._queue, (next_due, path, interval))
+        return paths
+
+
+def run_fixed_rate(tick: Callable[[float], None], tick_interval: float) -> None:
+    """Call tick(now) every tick_interval seconds without drift. Runs until interrupted.
+
+    A tick that takes longer than its budget (tick_interval) is reported and the missed ticks are skipped.
+    """
+    next_tick = time.monotonic()
+    while True:
+        tick(next_tick)
+
+        next_tick += tick_interval
+        late = time.monotonic() - next_tick
+        if late > 0:
+            missed = math.floor(late / tick_interval) + 1
+            logger.warning(f"Scan tick overran its {tick_interval}s budget by {late:.3f}s, skipping {missed} tick(s).")
+            print(f"Warning: scan tick overran its budget by {late:.3f}s, skipping {missed} tick(s).")
+            next_tick += missed * tick_interval
+
+        time.sleep(max(0.0, next_tick - time.monotonic()))
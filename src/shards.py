@@ -0,0 +1,251 @@
+#src/shards.py
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+from src import monitor
+from src.events import Event
+from src.records import FileRecord
+from src.metrics import ScanStats
+from src.storage import JsonBackend, load_files
+from src.throttle import IOBudget
+from src.utils import path_key
+
+logger = logging.getLogger(__name__)
+
+#how many shards (worker processes) a sharded scan uses
+SHARD_COUNT: int = os.cpu_count() or 1
+
+#how files are assigned to shards: "hash" spreads them evenly by a hash of the path,
+#"subtree" keeps all the files of a directory in one shard (better disk locality, hardlinks next to each other are hashed once)
+SHARD_MODE: str = "hash"
+
+#scan_files shards baselines of at least this many files (smaller ones are faster in one process)
+SHARD_THRESHOLD: int = 100_000
+
+#state files of the shards when a baseline is split between hosts or containers
+SHARD_DIR = Path("data") / "shards"
+MANIFEST_FILE = "manifest.json"
+
+
+def shard_of(path: str, count: int, mode: str = SHARD_MODE) -> int:
+    """Return the shard (0 .. count - 1) a path belongs to. The same on every host and Python process."""
+    if mode == "subtree":
+        key = os.path.dirname(path)
+    elif mode == "hash":
+        key = path
+    else:
+        raise ValueError(f"unknown shard mode {mode!r}")
+    return zlib.crc32(key.encode("utf-8", "surrogateescape")) % count
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """Parse an "i/n" shard spec (shard i of n, counting from 0)."""
+    index, _, count = spec.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"shard {spec!r} is not of the form i/n") from None
+    if not 0 <= index < count:
+        raise ValueError(f"shard {spec!r} is out of range")
+    return index, count
+
+def partition(files: List[FileRecord], count: int, mode: str = SHARD_MODE) -> List[List[int]]:
+    """Split the files into count shards, as lists of indexes into files (in their original order)."""
+    shards: List[List[int]] = [[] for _ in range(count)]
+    for i, file_info in enumerate(files):
+        shards[shard_of(file_info.path, count, mode)].append(i)
+    return shards
+
+def merge_events(shard_events: List[List[Event]], order: Dict[str, int]) -> List[Event]:
+    """Merge the events of the shards into one stream in the order of the files (order maps path -> position).
+
+    The sort is stable, so the events of one file keep the order scan_once reported them in.
+    """
+    events = [event for events in shard_events for event in events]
+    events.sort(key=lambda event: order.get(event.path, len(order)))
+    return events
+
+
+class _WorkerLogHandler(logging.Handler):
+    """Collects the log records of a worker process so they are sent back with its results.
+
+    The worker is forked from a process whose log queue is drained by a thread that does not exist in the
+    worker, so records must not go to the inherited handlers. Events are left out: the parent logs them
+    after merging the shards, in the order of the files.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: List[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if isinstance(record.args, tuple) and record.args and isinstance(record.args[0], Event):
+            return
+        #the message is rendered here so the record can be pickled
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+_worker_log: _WorkerLogHandler | None = None
+
+def _init_worker(count: int) -> None:
+    """Give every worker process its share of the hash threads and of the scan I/O budget,
+    and collect its log records instead of writing them to the inherited handlers."""
+    global _worker_log
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    _worker_log = _WorkerLogHandler()
+    root.addHandler(_worker_log)
+
+    monitor.HASH_WORKERS = max(1, monitor.HASH_WORKERS // count)
+    #the workers share the scan's budget (the default one or one set with monitor.set_scan_budget)
+    budget = monitor.get_scan_budget()
+    if not budget.unlimited:
+        monitor.set_scan_budget(IOBudget(budget.bytes.rate / count, budget.files.rate / count))
+
+def _scan_partition(files: List[FileRecord], full_rehash: bool) -> Tuple[List[Tuple[int, FileRecord]], List[Event], ScanStats,
+                                                                        List[logging.LogRecord]]:
+    """Worker: scan one shard and send back its events, stats, log records and only the records that changed
+    (as (position in the shard, record) pairs) to keep the transfer between processes small."""
+    before = [(file_info.state(), file_info.merkle) for file_info in files]
+    scan_stats = ScanStats()
+    events = monitor.scan_once(files, full_rehash, scan_stats)
+    changed = [(j, file_info) for j, (file_info, old) in enumerate(zip(files, before)) if (file_info.state(), file_info.merkle) != old]
+    records = []
+    if _worker_log is not None:
+        records, _worker_log.records = _worker_log.records, []
+    return changed, events, scan_stats, records
+
+def scan_sharded(monitored_files: List[FileRecord], count: int | None = None, mode: str = SHARD_MODE,
+                 full_rehash: bool = False, scan_stats: ScanStats | None = None) -> List[Event]:
+    """Like scan_once, but the files are partitioned into shards scanned by a pool of processes.
+
+    The records in monitored_files are updated in place and the events come back in the order of the files.
+    """
+    count = count or SHARD_COUNT
+    scan_stats = scan_stats if scan_stats is not None else ScanStats()
+    shards = [indexes for indexes in partition(monitored_files, count, mode) if indexes]
+    if not shards:
+        return []
+
+    with ProcessPoolExecutor(len(shards), initializer=_init_worker, initargs=(len(shards),)) as pool:
+        futures = [pool.submit(_scan_partition, [monitored_files[i] for i in indexes], full_rehash) for indexes in shards]
+        shard_events = []
+        for indexes, future in zip(shards, futures):
+            changed, events, stats, records = future.result()
+            for j, file_info in changed:
+                monitored_files[indexes[j]].copy_from(file_info)
+            shard_events.append(events)
+            scan_stats.add(stats)
+            for record in records:
+                logging.getLogger(record.name).handle(record)
+
+    #the workers do not log their events, they are logged here in the order of the files
+    events = merge_events(shard_events, {f.path: i for i, f in enumerate(monitored_files)})
+    for event in events:
+        monitor.log_event(event)
+    return events
+
+def scan_files(monitored_files: List[FileRecord], full_rehash: bool = False, scan_stats: ScanStats | None = None) -> List[Event]:
+    """Scan the files in this process, or sharded over SHARD_COUNT processes for large baselines."""
+    if SHARD_COUNT > 1 and len(monitored_files) >= SHARD_THRESHOLD:
+        return scan_sharded(monitored_files, full_rehash=full_rehash, scan_stats=scan_stats)
+    return monitor.scan_once(monitored_files, full_rehash, scan_stats)
+
+
+def shard_backend(index: int, count: int, directory: Path = SHARD_DIR) -> JsonBackend:
+    """The state file of one shard (one JSON list of records, like the JSON backend)."""
+    return JsonBackend(directory / f"shard-{index:04d}-of-{count:04d}.json")
+
+def split_baseline(files: List[FileRecord], count: int, mode: str = SHARD_MODE, directory: Path = SHARD_DIR) -> List[int]:
+    """Write the baseline as count shard state files plus a manifest. Returns the number of files per shard."""
+    directory.mkdir(parents=True, exist_ok=True)
+    shards = partition(files, count, mode)
+    for index, indexes in enumerate(shards):
+        shard_backend(index, count, directory).save_files([files[i] for i in indexes])
+
+    manifest = {"count": count, "mode": mode, "files": len(files), "created": time.time()}
+    (directory / MANIFEST_FILE).write_text(json.dumps(manifest, indent=4), encoding="utf-8")
+    logger.info(f"Split {len(files)} files into {count} shards ({mode}) in {directory}.")
+    return [len(indexes) for indexes in shards]
+
+def load_manifest(directory: Path = SHARD_DIR) -> Dict:
+    """Read the manifest written by split_baseline."""
+    try:
+        return json.loads((directory / MANIFEST_FILE).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        raise ValueError(f"no split baseline in {directory} (run split first)") from None
+
+def scan_shard(index: int, count: int, directory: Path = SHARD_DIR, full_rehash: bool = False,
+               scan_stats: ScanStats | None = None) -> List[Event]:
+    """Scan one shard of a split baseline and write its state back. Each host or container runs its own shard."""
+    manifest = load_manifest(directory)
+    if manifest["count"] != count:
+        raise ValueError(f"the baseline in {directory} is split into {manifest['count']} shards, not {count}")
+
+    backend = shard_backend(index, count, directory)
+    files = backend.load_files()
+    events = monitor.scan_once(files, full_rehash, scan_stats)
+    backend.save_files(files)
+    return events
+
+def join_shards(directory: Path = SHARD_DIR) -> List[FileRecord]:
+    """Read the records of every shard back into one list, sorted by path."""
+    count = load_manifest(directory)["count"]
+    files = [f for index in range(count) for f in shard_backend(index, count, directory).load_files()]
+    files.sort(key=lambda f: path_key(f.path))
+    return files
+
+
+def main() -> int:
+    """Command line: split the baseline into shards, scan one shard, or join the shards back."""
+    parser = argparse.ArgumentParser(description="Split the monitored files into shards scanned by separate hosts or processes.")
+    parser.add_argument("--dir", type=Path, default=SHARD_DIR, help="directory of the shard state files")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    split = sub.add_parser("split", help="split the current baseline into shard state files")
+    split.add_argument("--shards", type=int, default=SHARD_COUNT)
+    split.add_argument("--mode", choices=("hash", "subtree"), default=SHARD_MODE)
+    scan = sub.add_parser("scan", help="scan one shard and print its events as JSON lines")
+    scan.add_argument("--shard", required=True, help="i/n: shard i of n, counting from 0")
+    scan.add_argument("--full", action="store_true", help="rehash every file")
+    sub.add_parser("join", help="print the records of all shards as one JSON list")
+    merge = sub.add_parser("merge", help="merge the JSON-lines event output of several shards in path order")
+    merge.add_argument("files", nargs="+", type=Path)
+    args = parser.parse_args()
+
+    try:
+        return _run(args)
+    except (OSError, ValueError) as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+
+def _run(args: argparse.Namespace) -> int:
+    if args.cmd == "split":
+        sizes = split_baseline(load_files(), args.shards, args.mode, args.dir)
+        print(f"Split {sum(sizes)} files into {len(sizes)} shards in {args.dir} (largest {max(sizes)}).")
+    elif args.cmd == "scan":
+        index, count = parse_shard(args.shard)
+        for event in scan_shard(index, count, args.dir, args.full):
+            print(json.dumps(event.to_dict()))
+    elif args.cmd == "join":
+        print(json.dumps([f.to_dict() for f in join_shards(args.dir)], indent=4))
+    elif args.cmd == "merge":
+        events = [json.loads(line) for path in args.files for line in path.open(encoding="utf-8") if line.strip()]
+        events.sort(key=lambda event: path_key(event["path"]))
+        for event in events:
+            print(json.dumps(event))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+#src/snapshot.py
+from __future__ import annotations
+import argparse
+import gzip
+import json
+import os
+import socket
+import sys
+import time
+from pathlib import Path
+from json.decoder import scanstring
+from typing import Dict, Iterable, Iterator, Tuple, TypeVar
+from src import storage
+from src.events import Event, EventType
+from src.records import FileRecord
+from src.utils import atomic_write, path_key
+
+#a snapshot is a gzip file of JSON lines: one header line, then one compact record per line sorted by path
+#(in path_key order, the order of the stored baseline).
+#being sorted, two snapshots are diffed in one pass over both, holding one record of each in memory
+FORMAT = "file-monitor-snapshot"
+VERSION = 1
+
+#gzip compression level of written snapshots (1-9, lower is faster)
+COMPRESS_LEVEL: int = 6
+
+_PATH_KEY = '{"path":"'
+_PATH_START = len(_PATH_KEY)
+
+T = TypeVar("T")
+
+
+def _compact(record: FileRecord) -> Dict:
+    """Stored fields of a record only (the ISO dates and file name are derived again on import)."""
+    data = {
+        "path": record.path, "owner": record.owner, "group": record.group, "permissions": record.permissions,
+        "size": record.size, "created_ts": record.created_ts, "last_modified_ts": record.last_modified_ts,
+        "hash_algorithm": record.hash_algorithm, "hash_value": record.hash_value, "last_hash_ts": record.last_hash_ts,
+        "fingerprint": list(record.fingerprint) if record.fingerprint is not None else None,
+    }
+    if record.merkle is not None:
+        data["merkle"] = record.merkle
+    return data
+
+def write_snapshot(path: Path, records: Iterable[FileRecord]) -> int:
+    """Write records (sorted by path) to a snapshot file. Returns how many were written."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    header = {"format": FORMAT, "version": VERSION, "created": time.time(), "host": socket.gethostname()}
+    count = 0
+    last = None
+    #written to a temporary file that is swapped in when it is complete, like the JSON state file
+    with atomic_write(path) as tmp_file, gzip.open(tmp_file, "wt", encoding="utf-8", compresslevel=COMPRESS_LEVEL) as f:
+        f.write(json.dumps(header) + "\n")
+        for record in records:
+            key = path_key(record.path)
+            if last is not None and key <= last:
+                raise ValueError(f"snapshot records must be sorted by path: {record.path!r} after {os.fsdecode(last)!r}")
+            last = key
+            f.write(json.dumps(_compact(record), separators=(",", ":")) + "\n")
+            count += 1
+
+    return count
+
+def read_header(path: Path) -> Dict:
+    """Header of a snapshot file (format, version, creation time and host)."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return _read_header(f, path)
+
+def _read_header(f, path: Path) -> Dict:
+    """Read and check the header line of an open snapshot file."""
+    try:
+        header = json.loads(f.readline())
+    except (gzip.BadGzipFile, UnicodeDecodeError, json.JSONDecodeError):
+        header = None
+    if not isinstance(header, dict) or header.get("format") != FORMAT:
+        raise ValueError(f"{path} is not a snapshot file")
+    if header.get("version", 0) > VERSION:
+        raise ValueError(f"{path} is a version {header['version']} snapshot, only version {VERSION} is supported")
+    return header
+
+def _entries(path: Path) -> Iterator[Tuple[bytes, str]]:
+    """Yield (path_key, line) for every record of a snapshot file without parsing the whole line."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        _read_header(f, path)
+        last = None
+        for line in f:
+            #"path" is the first key of every line: {"path":"...",
+            file_path = scanstring(line, _PATH_START)[0] if line.startswith(_PATH_KEY) else json.loads(line)["path"]
+            key = path_key(file_path)
+            if last is not None and key <= last:
+                raise ValueError(f"{path} is not sorted by path at {file_path!r}")
+            last = key
+            yield key, line
+
+def read_snapshot(path: Path) -> Iterator[FileRecord]:
+    """Yield the records of a snapshot file one at a time, in path order."""
+    for _, line in _entries(path):
+        yield FileRecord.from_dict(json.loads(line))
+
+
+def compare_records(old: FileRecord, new: FileRecord) -> Iterator[Event]:
+    """Events for the differences between two records of the same file, in the order scan_once reports them."""
+    path = new.path
+    if old.owner != new.owner:
+        yield Event(EventType.OWNER_CHANGED, path, old.owner, new.owner)
+    if old.group != new.group:
+        yield Event(EventType.GROUP_CHANGED, path, old.group, new.group)
+    if old.permissions != new.permissions:
+        yield Event(EventType.PERMISSIONS_CHANGED, path, old.permissions, new.permissions)
+    if old.size != new.size:
+        yield Event(EventType.SIZE_CHANGED, path, old.size, new.size)
+    if old.last_modified_ts != new.last_modified_ts:
+        yield Event(EventType.MODIFIED, path, old.last_modified_ts, new.last_modified_ts)
+
+    #digests of different algorithms cannot be compared, the algorithm is shown with them
+    if old.hash_algorithm != new.hash_algorithm:
+        yield Event(EventType.HASH_CHANGED, path, f"{old.hash_algorithm}:{old.hash_value}", f"{new.hash_algorithm}:{new.hash_value}")
+    elif old.digest != new.digest:
+        yield Event(EventType.HASH_CHANGED, path, old.hash_value, new.hash_value)
+
+def _merge(old: Iterable[Tuple[bytes, T]], new: Iterable[Tuple[bytes, T]]) -> Iterator[Tuple[T | None, T | None]]:
+    """Walk two (path_key, item) streams sorted by key together, pairing the items of the same path
+    (None on the side a path is missing from)."""
+    old, new = iter(old), iter(new)
+    a, b = next(old, None), next(new, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[0] < b[0]):
+            yield a[1], None
+            a = next(old, None)
+        elif a is None or b[0] < a[0]:
+            yield None, b[1]
+            b = next(new, None)
+        else:
+            yield a[1], b[1]
+            a, b = next(old, None), next(new, None)
+
+def diff_records(old: Iterable[FileRecord], new: Iterable[FileRecord]) -> Iterator[Event]:
+    """Merge two path-sorted record streams and yield the changes from old to new in path order.
+
+    Files only in old are MISSING, files only in new are CREATED. Memory use does not depend on the number of files.
+    """
+    for a, b in _merge(((path_key(r.path), r) for r in old), ((path_key(r.path), r) for r in new)):
+        if b is None:
+            yield Event(EventType.MISSING, a.path)
+        elif a is None:
+            yield Event(EventType.CREATED, b.path)
+        else:
+            yield from compare_records(a, b)
+
+def diff_snapshots(old_path: Path, new_path: Path) -> Iterator[Event]:
+    """Stream the changes between two snapshot files (see diff_records). Only lines that differ are parsed."""
+    for a, b in _merge(_entries(old_path), _entries(new_path)):
+        if a == b:
+            continue
+        if b is None:
+            yield Event(EventType.MISSING, json.loads(a)["path"])
+        elif a is None:
+            yield Event(EventType.CREATED, json.loads(b)["path"])
+        else:
+            yield from compare_records(FileRecord.from_dict(json.loads(a)), FileRecord.from_dict(json.loads(b)))
+
+
+def main() -> int:
+    """Command line: export or import the baseline as a snapshot, or diff two snapshots."""
+    parser = argparse.ArgumentParser(description="Export, import and diff compressed baseline snapshots.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("export", help="write the current baseline to a snapshot file").add_argument("file", type=Path)
+    sub.add_parser("import", help="replace the current baseline with the records of a snapshot file").add_argument("file", type=Path)
+    diff = sub.add_parser("diff", help="print the changes between two snapshots")
+    diff.add_argument("old", type=Path)
+    diff.add_argument("new", type=Path)
+    diff.add_argument("--json", action="store_true", help="one JSON object per event")
+    args = parser.parse_args()
+
+    try:
+        return _run(args)
+    except (OSError, ValueError) as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+
+def _run(args: argparse.Namespace) -> int:
+    if args.cmd == "export":
+        print(f"Exported {storage.export_snapshot(args.file)} files to {args.file}.")
+    elif args.cmd == "import":
+        print(f"Imported {storage.import_snapshot(args.file)} files from {args.file}.")
+    elif args.cmd == "diff":
+        count = 0
+        for event in diff_snapshots(args.old, args.new):
+            print(json.dumps(event.to_dict()) if args.json else event.message)
+            count += 1
+        if not args.json:
+            print(f"{count} change(s).", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,72 +1,553 @@
 #src/storage.py
 from __future__ import annotations
 from pathlib import Path
+from bisect import bisect_left
+import fnmatch
 import json
-from typing import List, Dict
+import logging
+import os
+import sqlite3
+import threading
+from typing import Iterable, Iterator, List, Dict, Tuple
+from src.records import FileRecord, to_json, to_record
+from src import snapshot
+from src.utils import atomic_write, path_key
+
+logger = logging.getLogger(__name__)
 
 DATA_FILE = Path("data") / "monitored_files.json"
+ROOTS_FILE = Path("data") / "watched_roots.json"
+DB_FILE = Path("data") / "monitored_files.db"
 
-#files will be stored as a list of dictionaries in the JSON file
+#records read per query when the baseline is exported in path order
+EXPORT_BATCH: int = 5000
 
-def load_files() -> List[Dict]:
-    """Load the list of monitored files from the JSON file."""
+#which backend stores the monitored files: "sqlite" (default) or "json"
+STORAGE_BACKEND: str = "sqlite"
 
-    #ensure the data directory exists or create it if not
-    DATA_FILE.parent.mkdir(exist_ok=True)
 
-    #check if the data file exists or return an empty list
-    if not DATA_FILE.exists():
-        return []
+def subtree_bounds(directory: str) -> Tuple[str, str]:
+    """Every path below directory sorts in [low, high): the paths starting with directory + "/"."""
+    low = directory if directory.endswith(os.sep) else directory + os.sep
+    return low, low[:-1] + chr(ord(os.sep) + 1)
 
-    #open and read the JSON file. we attempt to parse it and convert JSON -> python objects, returning an empty list on failure
-    with DATA_FILE.open("r", encoding="utf-8") as f:
-        try:
-            data = json.load(f)
-        except json.JSONDecodeError:
+
+class PathIndex:
+    """Sorted list of monitored paths. A subtree is one contiguous slice found by binary search,
+    so counting, listing and removing it costs O(log n + k) and never looks at the filesystem.
+
+    The paths are kept as their sort keys (path_key) and decoded again when they are returned.
+    """
+
+    def __init__(self, paths: Iterable[str] = ()) -> None:
+        self._keys = sorted({path_key(path) for path in paths})
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, path: object) -> bool:
+        if not isinstance(path, str):
+            return False
+        key = path_key(path)
+        i = bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def add(self, path: str) -> None:
+        key = path_key(path)
+        i = bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            self._keys.insert(i, key)
+
+    def discard(self, path: str) -> None:
+        key = path_key(path)
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+    def _slice(self, directory: str | None) -> Tuple[int, int]:
+        if directory is None:
+            return 0, len(self._keys)
+        low, high = subtree_bounds(directory)
+        return bisect_left(self._keys, path_key(low)), bisect_left(self._keys, path_key(high))
+
+    def subtree(self, directory: str | None = None, recursive: bool = True, pattern: str | None = None,
+                after: str | None = None, limit: int | None = None) -> List[str]:
+        """Paths below directory (all paths for None) in sorted order.
+
+        Without recursive only the files directly in the directory, pattern is a glob on the full path,
+        and after/limit page through the result (the next page starts after the last path of this one).
+        """
+        start, end = self._slice(directory)
+        after_key = path_key(after) if after is not None else None
+        if after_key is not None:
+            start = max(start, bisect_left(self._keys, after_key))
+        prefix_len = len(path_key(subtree_bounds(directory)[0])) if directory is not None else 0
+        sep = path_key(os.sep)
+
+        paths: List[str] = []
+        for i in range(start, end):
+            key = self._keys[i]
+            if after_key is not None and key <= after_key:
+                continue
+            if not recursive and directory is not None and sep in key[prefix_len:]:
+                continue
+            path = os.fsdecode(key)
+            if pattern is not None and not fnmatch.fnmatchcase(path, pattern):
+                continue
+            paths.append(path)
+            if limit is not None and len(paths) >= limit:
+                break
+        return paths
+
+    def count(self, directory: str | None = None, recursive: bool = True, pattern: str | None = None) -> int:
+        """Number of paths below directory."""
+        if recursive and pattern is None:
+            start, end = self._slice(directory)
+            return end - start
+        return len(self.subtree(directory, recursive, pattern))
+
+    def remove_subtree(self, directory: str, recursive: bool = True) -> List[str]:
+        """Drop the paths below directory from the index and return them."""
+        start, end = self._slice(directory)
+        if recursive:
+            removed = [os.fsdecode(key) for key in self._keys[start:end]]
+            del self._keys[start:end]
+            return removed
+        removed = self.subtree(directory, recursive=False)
+        gone = {path_key(path) for path in removed}
+        self._keys[start:end] = [key for key in self._keys[start:end] if key not in gone]
+        return removed
+
+
+class JsonBackend:
+    """Stores the monitored files as a list of dictionaries in one JSON file."""
+
+    def __init__(self, data_file: Path = DATA_FILE, roots_file: Path | None = None) -> None:
+        self.data_file = data_file
+        self.roots_file = roots_file or data_file.with_name(ROOTS_FILE.name)
+
+        #path index of the records as of the last read of the data file (size and mtime of the file, index, records)
+        self._index: Tuple[Tuple[int, int] | None, PathIndex, Dict[str, FileRecord]] | None = None
+
+    def load_files(self) -> List[FileRecord]:
+        """Load the list of monitored files from the JSON file."""
+
+        #ensure the data directory exists or create it if not
+        self.data_file.parent.mkdir(exist_ok=True)
+
+        #check if the data file exists or return an empty list
+        if not self.data_file.exists():
             return []
-        
-    #data should be a list of dictionaries
-    return data
 
-def save_files(files: List[Dict]) -> None:
-    """Save the list of monitored files to the JSON file."""
+        #open and read the JSON file. we attempt to parse it and convert JSON -> python objects, returning an empty list on failure
+        with self.data_file.open("r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                return []
+
+        #data should be a list of dictionaries, they are kept as compact records in memory
+        return [FileRecord.from_dict(f) for f in data]
+
+    def save_files(self, files: List[FileRecord]) -> None:
+        """Save the list of monitored files to the JSON file."""
+
+        #write the list of dictionaries to the file as JSON with indentation for readability
+        _write_json(self.data_file, [to_json(f) for f in files], indent=4)
+        self._index = None
+
+    def replace_files(self, files: Iterable[FileRecord]) -> int:
+        """Replace every stored record. Returns how many were written."""
+        files = list(files)
+        self.save_files(files)
+        return len(files)
+
+    def update_files(self, files: List[FileRecord]) -> None:
+        """Write back changed records. The JSON file can only be rewritten as a whole."""
+        updated = {f.path: f for f in files}
+        stored = self.load_files()
+        self.save_files([updated.pop(f.path, f) for f in stored] + list(updated.values()))
+
+    def add_file(self, file_info: FileRecord) -> None:
+        """Add a new file to the monitored files list."""
+
+        #load existing files
+        files = self.load_files()
+
+        #check for dupes
+        if any(f.path == file_info.path for f in files):
+            return  #file already exists, do not add again
+
+        #add new file to list
+        files.append(file_info)
+
+        #save new list
+        self.save_files(files)
+
+    def add_files(self, file_infos: Iterable[FileRecord]) -> int:
+        """Add many files with one load and one write. Returns how many were not monitored yet."""
+
+        #load existing files once and dedupe on path with a set
+        files = self.load_files()
+        paths = {f.path for f in files}
+
+        added = 0
+        for file_info in file_infos:
+            if file_info.path in paths:
+                continue
+            paths.add(file_info.path)
+            files.append(file_info)
+            added += 1
+
+        #single atomic write
+        if added:
+            self.save_files(files)
+        return added
+
+    def remove_file(self, file_path: str) -> None:
+        """Remove a file from the monitored files list by its path."""
+
+        #load existing files
+        files = self.load_files()
+
+        #filter out the file to be removed
+        files = [f for f in files if f.path != file_path]
+
+        #save updated list
+        self.save_files(files)
+
+    def _indexed(self) -> Tuple[PathIndex, Dict[str, FileRecord]]:
+        """Path index and records by path, read again only when the data file changed."""
+        try:
+            st = self.data_file.stat()
+            key = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            key = None
+        if self._index is None or self._index[0] != key:
+            files = self.load_files()
+            self._index = (key, PathIndex(f.path for f in files), {f.path: f for f in files})
+        return self._index[1], self._index[2]
+
+    def list_files(self, directory: str | None = None, recursive: bool = True, pattern: str | None = None,
+                   after: str | None = None, limit: int | None = None) -> List[FileRecord]:
+        """Monitored files below a directory sorted by path (see PathIndex.subtree for the filters)."""
+        index, by_path = self._indexed()
+        return [by_path[path].copy() for path in index.subtree(directory, recursive, pattern, after, limit)]
+
+    def has_file(self, path: str) -> bool:
+        """Check if a path is monitored."""
+        index, _ = self._indexed()
+        return path in index
+
+    def count_files(self, directory: str | None = None, recursive: bool = True, pattern: str | None = None) -> int:
+        """Number of monitored files below a directory."""
+        index, _ = self._indexed()
+        return index.count(directory, recursive, pattern)
+
+    def remove_subtree(self, directory: str, recursive: bool = True) -> int:
+        """Remove every monitored file below a directory (it does not have to exist anymore). Returns how many."""
+        index, by_path = self._indexed()
+        gone = set(index.subtree(directory, recursive))
+        if gone:
+            self.save_files([f for path, f in by_path.items() if path not in gone])
+        return len(gone)
+
+    def load_roots(self) -> Dict[str, Dict]:
+        """Load the watched root directories (keyed by path) from their JSON file."""
+        if not self.roots_file.exists():
+            return {}
+        with self.roots_file.open("r", encoding="utf-8") as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return {}
+
+    def save_roots(self, roots: Dict[str, Dict]) -> None:
+        """Save the watched root directories to their JSON file."""
+        _write_json(self.roots_file, roots)
+
+
+class SqliteBackend:
+    """Stores the monitored files in an SQLite database (WAL mode, one row per file, indexed on path)."""
+
+    def __init__(self, db_file: Path = DB_FILE, json_file: Path | None = DATA_FILE) -> None:
+        self.db_file = db_file
+        self.db_file.parent.mkdir(exist_ok=True)
+
+        #one connection shared by the threads of this process
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+        #rows keep the insertion order (id) and the unique path column is indexed.
+        #paths are stored as their file system bytes (see utils.path_key)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "id INTEGER PRIMARY KEY, path BLOB NOT NULL UNIQUE, data TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS roots (path BLOB PRIMARY KEY, data TEXT NOT NULL)")
+        self._conn.commit()
+
+        #databases written before the paths were bytes: their UTF-8 text paths are the same bytes
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+            with self._conn:
+                self._conn.execute("UPDATE files SET path = CAST(path AS BLOB) WHERE typeof(path) = 'text'")
+                self._conn.execute("UPDATE roots SET path = CAST(path AS BLOB) WHERE typeof(path) = 'text'")
+                self._conn.execute("PRAGMA user_version = 1")
+
+        #hash of the serialized form of every row as last read/written, so saving only writes changed rows
+        self._saved: Dict[str, int] = {}
+
+        #one-shot migration from the old JSON state file
+        if json_file is not None and json_file.exists() and self._is_empty():
+            self.migrate_json(json_file)
+
+    def _is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+
+    def migrate_json(self, json_file: Path) -> int:
+        """Import the records of a JSON state file and rename it so it is only migrated once."""
+        files = JsonBackend(json_file).load_files()
+        self.update_files(files)
+        json_file.rename(json_file.with_name(json_file.name + ".migrated"))
+        logger.info(f"Migrated {len(files)} monitored files from {json_file} to {self.db_file}.")
+        return len(files)
+
+    def load_files(self) -> List[FileRecord]:
+        """Load the list of monitored files from the database."""
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM files ORDER BY id").fetchall()
+            files = [FileRecord.from_dict(json.loads(data)) for data, in rows]
+            self._saved = {f.path: hash(f.state()) for f in files}
+        return files
+
+    def save_files(self, files: List[FileRecord]) -> None:
+        """Save the list of monitored files, writing only the rows that changed since they were loaded."""
+        files = [to_record(f) for f in files]
+        paths = {f.path for f in files}
+
+        with self._lock:
+            #unchanged records are found from their fields, only the changed ones are serialized
+            changed = [f for f in files if self._saved.get(f.path) != hash(f.state())]
+            removed = [path for path in self._saved if path not in paths]
+            if not changed and not removed:
+                return
+
+            #one transaction for the whole pass
+            with self._conn:
+                self._conn.executemany("DELETE FROM files WHERE path = ?", [(path_key(path),) for path in removed])
+                self._upsert(changed)
+
+            for path in removed:
+                del self._saved[path]
+
+    def replace_files(self, files: Iterable[FileRecord]) -> int:
+        """Replace every stored record in one transaction, streaming the new ones in. Returns how many were written."""
+        rows = ((path_key(f.path), _serialize(f)) for f in files)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files")
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT INTO files (path, data) VALUES (?, ?)", rows)
+            count = self._conn.total_changes - before
+
+        #every row is new, the next load reads them again
+        self._saved = {}
+        return count
+
+    def update_files(self, files: List[FileRecord]) -> None:
+        """Write back only the given records (inserting the ones that are not stored yet)."""
+        files = [to_record(f) for f in files]
+        with self._lock, self._conn:
+            self._upsert(files)
+
+    def _upsert(self, files: List[FileRecord]) -> None:
+        self._conn.executemany(
+            "INSERT INTO files (path, data) VALUES (?, ?) ON CONFLICT(path) DO UPDATE SET data = excluded.data",
+            [(path_key(f.path), _serialize(f)) for f in files],
+        )
+        for f in files:
+            self._saved[f.path] = hash(f.state())
+
+    def add_file(self, file_info: FileRecord) -> None:
+        """Add a new file to the monitored files unless its path is already stored."""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO files (path, data) VALUES (?, ?)", (path_key(file_info.path), _serialize(file_info)))
+
+    def add_files(self, file_infos: Iterable[FileRecord]) -> int:
+        """Add many files in one transaction. Returns how many were not monitored yet."""
+        rows = ((path_key(f.path), _serialize(f)) for f in file_infos)
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO files (path, data) VALUES (?, ?)", rows)
+            return self._conn.total_changes - before
+
+    def remove_file(self, file_path: str) -> None:
+        """Remove a file from the monitored files by its path."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (path_key(file_path),))
+        self._saved.pop(file_path, None)
+
+    @staticmethod
+    def _where(directory: str | None, recursive: bool, pattern: str | None, after: str | None) -> Tuple[str, List]:
+        """WHERE clause selecting a subtree. The path range is answered from the index on the path column."""
+        clauses, params = ["1"], []
+        if directory is not None:
+            low, high = (path_key(bound) for bound in subtree_bounds(directory))
+            clauses.append("path >= ? AND path < ?")
+            params += [low, high]
+            if not recursive:
+                clauses.append("instr(substr(path, ?), ?) = 0")
+                params += [len(low) + 1, path_key(os.sep)]
+        if after is not None:
+            clauses.append("path > ?")
+            params.append(path_key(after))
+        if pattern is not None:
+            clauses.append("CAST(path AS TEXT) GLOB ?")
+            params.append(pattern)
+        return " AND ".join(clauses), params
+
+    def list_files(self, directory: str | None = None, recursive: bool = True, pattern: str | None = None,
+                   after: str | None = None, limit: int | None = None) -> List[FileRecord]:
+        """Monitored files below a directory sorted by path (see PathIndex.subtree for the filters)."""
+        where, params = self._where(directory, recursive, pattern, after)
+        with self._lock:
+            rows = self._conn.execute(f"SELECT data FROM files WHERE {where} ORDER BY path LIMIT ?",
+                                      params + [limit if limit is not None else -1]).fetchall()
+        return [FileRecord.from_dict(json.loads(data)) for data, in rows]
+
+    def has_file(self, path: str) -> bool:
+        """Check if a path is monitored."""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM files WHERE path = ?", (path_key(path),)).fetchone() is not None
+
+    def count_files(self, directory: str | None = None, recursive: bool = True, pattern: str | None = None) -> int:
+        """Number of monitored files below a directory."""
+        where, params = self._where(directory, recursive, pattern, None)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM files WHERE {where}", params).fetchone()[0]
+
+    def remove_subtree(self, directory: str, recursive: bool = True) -> int:
+        """Remove every monitored file below a directory (it does not have to exist anymore). Returns how many."""
+        where, params = self._where(directory, recursive, None, None)
+        with self._lock, self._conn:
+            removed = self._conn.execute(f"DELETE FROM files WHERE {where} RETURNING path", params).fetchall()
+        for path, in removed:
+            self._saved.pop(os.fsdecode(path), None)
+        return len(removed)
+
+    def load_roots(self) -> Dict[str, Dict]:
+        """Load the watched root directories (keyed by path)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path, data FROM roots").fetchall()
+        return {os.fsdecode(path): json.loads(data) for path, data in rows}
+
+    def save_roots(self, roots: Dict[str, Dict]) -> None:
+        """Replace the watched root directories in one transaction."""
+        rows = [(path_key(path), json.dumps(root, separators=(",", ":"))) for path, root in roots.items()]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM roots")
+            self._conn.executemany("INSERT INTO roots (path, data) VALUES (?, ?)", rows)
+
+
+def _serialize(file_info: FileRecord | Dict) -> str:
+    """Compact JSON form of one record (a row of the files table)."""
+    return json.dumps(to_json(file_info), separators=(",", ":"))
+
+def _write_json(path: Path, data, indent: int | None = None) -> None:
+    """Write JSON to a temporary file and swap it in so a crash never leaves a half written state file."""
 
     #ensure the data directory exists or create it if not
-    DATA_FILE.parent.mkdir(exist_ok=True)
+    path.parent.mkdir(exist_ok=True)
 
     #open and write the JSON file. we convert python objects -> JSON
-    with DATA_FILE.open("w", encoding="utf-8") as f:
+    with atomic_write(path) as tmp_file, tmp_file.open("w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent)
 
-        #write the list of dictionaries to the file as JSON with indentation for readability
-        json.dump(files, f, indent=4)
 
+_backend = None
 
-def add_file(file_info: Dict) -> None:
-    """Add a new file to the monitored files list."""
+def get_backend():
+    """Return the storage backend selected by STORAGE_BACKEND, creating it on first use."""
+    global _backend
+    if _backend is None:
+        _backend = SqliteBackend() if STORAGE_BACKEND == "sqlite" else JsonBackend()
+    return _backend
+
+def set_backend(backend) -> None:
+    """Use a specific storage backend (e.g. one pointing to another data directory)."""
+    global _backend
+    _backend = backend
 
-    #load existing files
-    files = load_files()
+#module level helpers used by the rest of the tool
 
-    #check for dupes
-    if any(f.get("path") == file_info.get("path") for f in files):
-        return  #file already exists, do not add again
-    
-    #add new file to list
-    files.append(file_info)
+def load_files() -> List[FileRecord]:
+    """Load the list of monitored files."""
+    return get_backend().load_files()
 
-    #save new list
-    save_files(files)
+def save_files(files: List[FileRecord]) -> None:
+    """Save the list of monitored files."""
+    get_backend().save_files(files)
+
+def update_files(files: List[FileRecord]) -> None:
+    """Write back only the given monitored file records."""
+    get_backend().update_files(files)
+
+def add_file(file_info: FileRecord) -> None:
+    """Add a new file to the monitored files list."""
+    get_backend().add_file(file_info)
+
+def add_files(file_infos: Iterable[FileRecord]) -> int:
+    """Add many files to the monitored files list in one batch. Returns how many were added."""
+    return get_backend().add_files(file_infos)
 
 def remove_file(file_path: str) -> None:
     """Remove a file from the monitored files list by its path."""
+    get_backend().remove_file(file_path)
+
+def list_files(directory: str | None = None, recursive: bool = True, pattern: str | None = None,
+               after: str | None = None, limit: int | None = None) -> List[FileRecord]:
+    """List the monitored files below a directory in path order, filtered and one page at a time."""
+    return get_backend().list_files(directory, recursive, pattern, after, limit)
+
+def has_file(path: str) -> bool:
+    """Check if a path is monitored."""
+    return get_backend().has_file(path)
+
+def count_files(directory: str | None = None, recursive: bool = True, pattern: str | None = None) -> int:
+    """Count the monitored files below a directory."""
+    return get_backend().count_files(directory, recursive, pattern)
+
+def remove_subtree(directory: str, recursive: bool = True) -> int:
+    """Remove every monitored file below a directory, from the stored paths only. Returns how many."""
+    return get_backend().remove_subtree(directory, recursive)
 
-    #load existing files
-    files = load_files()
+def iter_files(batch: int = EXPORT_BATCH, after: str | None = None) -> Iterator[FileRecord]:
+    """Yield the monitored files in path order (from the first path after after), reading batch records at a time."""
+    while True:
+        files = get_backend().list_files(after=after, limit=batch)
+        yield from files
+        if len(files) < batch:
+            return
+        after = files[-1].path
 
-    #filter out the file to be removed
-    files = [f for f in files if f.get("path") != file_path]
+def export_snapshot(path: Path) -> int:
+    """Write the monitored files to a compressed, path-sorted snapshot file. Returns how many were written."""
+    count = snapshot.write_snapshot(path, iter_files())
+    logger.info(f"Exported {count} monitored files to {path}.")
+    return count
 
-    #save updated list
-    save_files(files)
+def import_snapshot(path: Path) -> int:
+    """Replace the monitored files with the records of a snapshot file. Returns how many were imported."""
+    count = get_backend().replace_files(snapshot.read_snapshot(path))
+    logger.info(f"Imported {count} monitored files from {path}.")
+    return count
 
+def load_roots() -> Dict[str, Dict]:
+    """Load the watched root directories."""
+    return get_backend().load_roots()
 
+def save_roots(roots: Dict[str, Dict]) -> None:
+    """Save the watched root directories."""
+    get_backend().save_roots(roots)
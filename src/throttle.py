@@ -0,0 +1,57 @@
+#src/throttle.py
+from __future__ import annotations
+import threading
+import time
+
+
+class RateLimiter:
+    """Thread-safe rate limiter: acquire(amount) blocks so that on average at most rate units pass per second."""
+
+    def __init__(self, rate: float, burst: float | None = None) -> None:
+        self.rate = rate
+
+        #how far ahead of the rate the caller may get (default one second worth)
+        self.burst = burst if burst is not None else rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float) -> None:
+        """Take amount units, sleeping until the rate allows it (a rate of 0 means unlimited)."""
+        if self.rate <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+
+            #the time at which the budget is used up, never further back than one burst
+            self._next = max(self._next, now - self.burst / self.rate)
+            self._next += amount / self.rate
+            wait = self._next - now
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class IOBudget:
+    """Limits how many bytes and how many files per second a scan may read (0 means unlimited)."""
+
+    def __init__(self, bytes_per_sec: float = 0, files_per_sec: float = 0) -> None:
+        self.bytes = RateLimiter(bytes_per_sec)
+        self.files = RateLimiter(files_per_sec)
+
+    @property
+    def unlimited(self) -> bool:
+        return self.bytes.rate <= 0 and self.files.rate <= 0
+
+    def open_file(self) -> None:
+        """Wait until another file may be opened."""
+        self.files.acquire(1)
+
+    def read(self, nbytes: int) -> None:
+        """Account for nbytes that were read, waiting if the byte budget is used up."""
+        self.bytes.acquire(nbytes)
+
+
+def budget_for_window(total_bytes: int, total_files: int, window: float) -> IOBudget:
+    """Budget that reads total_bytes in total_files evenly over window seconds instead of in one burst."""
+    return IOBudget(total_bytes / window, total_files / window)
@@ -1,7 +1,20 @@
 from __future__ import annotations
+import atexit
+import fnmatch
 import logging
+import os
+import queue
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Iterator
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Tuple, TypeVar
+from src.events import Event, Severity
+from src.log_pipeline import (BatchedFileHandler, BatchedRotatingFileHandler, JsonLinesFormatter, LogPipeline,
+                              PipelineQueueHandler)
+
+T = TypeVar("T")
+R = TypeVar("R")
 
 #colors for CLI output
 RESET = "\033[0m"
@@ -9,60 +22,214 @@ RED = "\033[31m"
 YELLOW = "\033[33m"
 CYAN = "\033[36m"
 
+#logging pipeline: records go through a bounded queue to a background thread that writes them in batches
+LOG_QUEUE_SIZE = 10000          #records waiting to be written
+LOG_QUEUE_POLICY = "drop"       #"drop" new records when the queue is full (counted and logged) or "block" the caller
+LOG_BATCH_SIZE = 500            #flush the sinks after this many records...
+LOG_FLUSH_INTERVAL = 1.0        #...or this many seconds, whichever comes first
+LOG_MAX_BYTES = 0               #rotate file_monitor.log at this size (0 disables rotation)
+LOG_BACKUP_COUNT = 5            #rotated logs to keep
+LOG_JSONL_FILE: Path | None = None   #extra sink with one JSON object per record (e.g. Path("logs") / "events.jsonl")
+
+_log_pipeline: LogPipeline | None = None
+
 #setup logging
 def setup_logging() -> None:
-    """Setup logging configuration."""
+    """Setup logging configuration. Logging calls only enqueue the record, the writing happens on a background thread."""
+    global _log_pipeline
+    if _log_pipeline is not None:
+        return
 
     log_dir = Path("logs")
     log_dir.mkdir(exist_ok=True)
 
     log_file = log_dir / "file_monitor.log"
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        handlers=[
-            logging.FileHandler(log_file),
-            #logging.StreamHandler()
-        ],
-    )
+    if LOG_MAX_BYTES:
+        file_handler = BatchedRotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    else:
+        file_handler = BatchedFileHandler(log_file)
+    file_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    sinks: List[logging.Handler] = [file_handler]
+    if LOG_JSONL_FILE is not None:
+        LOG_JSONL_FILE.parent.mkdir(parents=True, exist_ok=True)
+        jsonl_handler = BatchedFileHandler(LOG_JSONL_FILE)
+        jsonl_handler.setFormatter(JsonLinesFormatter())
+        sinks.append(jsonl_handler)
+
+    log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = PipelineQueueHandler(log_queue, block=LOG_QUEUE_POLICY == "block")
+    _log_pipeline = LogPipeline(log_queue, handler, sinks, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL)
+    _log_pipeline.start()
+    #write what is still queued on exit
+    atexit.register(_log_pipeline.stop)
+
+    logging.basicConfig(level=logging.INFO, handlers=[handler])
+
 
 
+#terminal color for every severity level
+SEVERITY_COLORS = {
+    Severity.CRITICAL: RED,
+    Severity.WARNING: YELLOW,
+    Severity.INFO: CYAN,
+}
 
 #classify event type and return color and severity
-def classify_event(event: str) -> tuple[str, str]:
+def classify_event(event: Event) -> tuple[str, str]:
     """Classify event type for colored output."""
 
-    #i consider hash changes and missing files as critical, owner/group/permission changes as warning, size/modification as info
-    if "[HASH_CHANGED]" in event or "[MISSING]" in event:
-        return RED, "CRITICAL"
-    elif any(tag in event for tag in ["[OWNER_CHANGED]", "[GROUP_CHANGED]", "[PERMISSIONS_CHANGED]"]):
-        return YELLOW, "WARNING"
-    elif any(tag in event for tag in ["[SIZE_CHANGED]", "[MODIFIED]"]):
-        return CYAN, "INFO"
-    else:
-        return "", "INFO"
+    #the severity is precomputed when the event is created
+    return SEVERITY_COLORS[event.severity], event.severity.name
 
-def format_event(event: str) -> str:
+def format_event(event: Event) -> str:
     """Format event with color coding."""
     color, severity = classify_event(event)
     if color:
         return f"{color}{severity}{event}{RESET}"
-    return event
+    return str(event)
 
 
 def normalize_path(path: str) -> Path:
     """Normalize a file path to its absolute resolved form."""
     return Path(path).expanduser().resolve()
 
+def path_key(path: str) -> bytes:
+    """Sort key of a path: its file system bytes. Paths are ordered by it everywhere (the SQLite index, PathIndex,
+    snapshots), so names that are not valid UTF-8 (decoded with surrogate escapes) sort the same in all of them."""
+    return os.fsencode(path)
+
+@contextmanager
+def atomic_write(path: Path) -> Iterator[Path]:
+    """Yield a temporary file next to path to write to, and swap it in for path when the block finishes,
+    so a crash or an error never leaves a half written file (a reader sees the old file or the new one)."""
+    tmp_file = path.with_name(path.name + ".tmp")
+    try:
+        yield tmp_file
+    except BaseException:
+        tmp_file.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_file, path)
+
+def advise(fd: int, offset: int, length: int, advice: str) -> None:
+    """posix_fadvise with the POSIX_FADV_<advice> constant, where it is available
+    (it is only a hint, so errors are ignored)."""
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, offset, length, getattr(os, f"POSIX_FADV_{advice}"))
+        except OSError:
+            pass
+
+
+#directories and files skipped by default when adding a directory
+DEFAULT_EXCLUDES = [".git", "node_modules", "__pycache__", ".cache", ".mypy_cache", ".pytest_cache"]
+
+#number of threads listing subtrees in parallel in walk_files
+WALK_WORKERS: int = 4
+
+def matches_patterns(name: str, rel_path: str, patterns: List[str]) -> bool:
+    """Check a directory entry against glob patterns (matched on its name or its path relative to the root)."""
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(rel_path, p) for p in patterns)
+
+def walk_files(directory: Path, recursive: bool = True, include: List[str] | None = None,
+               exclude: List[str] | None = None, max_depth: int | None = None, skip_hidden: bool = False,
+               one_filesystem: bool = False, workers: int = 1, base: Path | None = None,
+               dir_mtimes: Dict[str, int] | None = None,
+               skip_dirs: Set[str] | None = None) -> Iterator[Tuple[Path, os.stat_result]]:
+    """Walk a directory with os.scandir and yield (path, stat) for every file.
+
+    include/exclude are glob patterns, max_depth limits how many directory levels are entered
+    (recursive=False is max_depth 0), skip_hidden skips hidden directories, one_filesystem stays on
+    the filesystem of the root, and workers > 1 lists subtrees in parallel (in no particular order).
+    Patterns are matched on paths relative to base (default the directory itself). The mtime of every
+    listed directory is stored in dir_mtimes when given, and directories in skip_dirs are not entered.
+    """
+    root = str(directory)
+    prefix_len = len(str(base or directory).rstrip(os.sep)) + 1
+    root_dev = os.stat(root).st_dev
+    exclude = exclude or []
+    if not recursive:
+        max_depth = 0
+
+    def list_directory(path: str, depth: int) -> Tuple[List[Tuple[Path, os.stat_result]], List[Tuple[str, int]]]:
+        files = []
+        subdirs = []
+        try:
+            #the mtime is taken before listing so changes made during the listing are seen next time
+            if dir_mtimes is not None:
+                dir_mtimes[path] = os.stat(path).st_mtime_ns
+            entries = os.scandir(path)
+        except OSError as exc:
+            logging.getLogger(__name__).warning(f"Cannot list {path}: {exc}")
+            return files, subdirs
+
+        with entries:
+            for entry in entries:
+                name = entry.name
+                rel_path = entry.path[prefix_len:]
+                if matches_patterns(name, rel_path, exclude):
+                    continue
+                try:
+                    #the DirEntry type comes from readdir, so only the kept files/directories are stat'ed
+                    if entry.is_dir(follow_symlinks=False):
+                        if max_depth is not None and depth >= max_depth:
+                            continue
+                        if skip_hidden and name.startswith("."):
+                            continue
+                        if skip_dirs is not None and entry.path in skip_dirs:
+                            continue
+                        if one_filesystem and entry.stat(follow_symlinks=False).st_dev != root_dev:
+                            continue
+                        subdirs.append((entry.path, depth + 1))
+                    elif entry.is_file():
+                        if include and not matches_patterns(name, rel_path, include):
+                            continue
+                        files.append((Path(entry.path), entry.stat()))
+                except OSError:
+                    #the entry disappeared while walking
+                    continue
+        return files, subdirs
+
+    if workers <= 1:
+        stack = [(root, 0)]
+        while stack:
+            files, subdirs = list_directory(*stack.pop())
+            yield from files
+            stack.extend(reversed(subdirs))
+        return
+
+    #fan out: every directory listing is a task, and the subdirectories it finds are submitted as new tasks
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(list_directory, root, 0)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                yield from files
+                pending.update(executor.submit(list_directory, path, depth) for path, depth in subdirs)
 
 #iterate over files in a directory (with optional recursion) for adding multiple files to monitoring
 def iter_directory_files(directory: Path, recursive: bool = False) -> Iterator[Path]:
     """Iterate over all files in a directory. If recursive is True, include subdirectories."""
-    if recursive:
-        for p in directory.rglob("*"):
-            if p.is_file():
-                yield p
-    else:
-        for p in directory.iterdir():
-            if p.is_file():
-                yield p
\ No newline at end of file
+    for path, _ in walk_files(directory, recursive):
+        yield path
+
+
+#run a function over many items on a worker pool, keeping at most queue_depth items in flight
+def bounded_map(func: Callable[[T], R], items: Iterable[T], workers: int, queue_depth: int) -> Iterator[R]:
+    """Apply func to items concurrently and yield the results in input order."""
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+
+            #wait for the oldest result once the queue is full so memory stays bounded
+            if len(pending) >= queue_depth:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,195 @@
+#src/watcher.py
+from __future__ import annotations
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+from typing import Callable, Dict, List, Set, Tuple
+from src.monitor import scan_once
+from src.metrics import ScanStats, record_scan
+from src.records import FileRecord
+
+logger = logging.getLogger(__name__)
+
+#inotify event flags (from <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+#events on a watched directory that can change the metadata of a file inside it
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+#struct inotify_event header: wd, mask, cookie, len (followed by len bytes of name)
+_EVENT_HEADER = struct.Struct("iIII")
+
+#full scan every SAFETY_SCAN_INTERVAL seconds in case an event was lost,
+#and files in directories that could not be watched are polled every FALLBACK_SCAN_INTERVAL seconds
+SAFETY_SCAN_INTERVAL: float = 300.0
+FALLBACK_SCAN_INTERVAL: float = 5.0
+
+#after the first event, wait this long for more so a burst is scanned in one pass
+BATCH_DELAY: float = 0.05
+
+
+class Inotify:
+    """Thin ctypes wrapper around the Linux inotify syscalls."""
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._libc = libc
+
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.fd = fd
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        """Watch a path and return its watch descriptor. Raises OSError (ENOSPC when the watch limit is reached)."""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def remove_watch(self, wd: int) -> None:
+        """Stop watching a watch descriptor."""
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout: float | None) -> List[Tuple[int, int, str]]:
+        """Wait up to timeout seconds for events and return them as (wd, mask, name) tuples."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                events.append((wd, mask, name))
+        return events
+
+    def close(self) -> None:
+        """Close the inotify file descriptor."""
+        os.close(self.fd)
+
+
+def watch_and_scan(monitored_files: List[FileRecord], report: Callable[[List], None]) -> None:
+    """Watch the directories of the monitored files and scan only the files the kernel reports as touched.
+
+    report is called with the events of every pass that ran. Runs until interrupted.
+    """
+
+    #index the monitored files by path (and keep their order for deterministic passes)
+    order = {f.path: i for i, f in enumerate(monitored_files)}
+    by_dir: Dict[str, List[str]] = {}
+    for path in order:
+        by_dir.setdefault(os.path.dirname(path), []).append(path)
+
+    inotify = Inotify()
+    watches: Dict[int, str] = {}
+    unwatched: Set[str] = set()
+
+    def watch(directory: str) -> None:
+        try:
+            watches[inotify.add_watch(directory)] = directory
+            unwatched.discard(directory)
+        except OSError as exc:
+            if exc.errno == errno.ENOSPC:
+                logger.warning(f"inotify watch limit reached, polling {directory} instead.")
+            unwatched.add(directory)
+
+    def scan(paths) -> None:
+        files = [monitored_files[i] for i in sorted(order[p] for p in paths)]
+        scan_stats = ScanStats()
+        events = scan_once(files, scan_stats=scan_stats)
+        with scan_stats.phase("save"):
+            report(events)
+        record_scan(scan_stats)
+
+    for directory in by_dir:
+        watch(directory)
+    logger.info(f"Watching {len(watches)} directories, polling {len(unwatched)}.")
+
+    now = time.monotonic()
+    next_safety_scan = now + SAFETY_SCAN_INTERVAL
+    next_fallback_scan = now + FALLBACK_SCAN_INTERVAL
+
+    try:
+        while True:
+            deadline = min(next_safety_scan, next_fallback_scan) if unwatched else next_safety_scan
+            events = inotify.read_events(max(0.0, deadline - time.monotonic()))
+            if events:
+                #collect the rest of the burst
+                time.sleep(BATCH_DELAY)
+                events += inotify.read_events(0)
+
+            touched: Set[str] = set()
+            overflow = False
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+
+                directory = watches.get(wd)
+                if directory is None:
+                    continue
+
+                if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    #the directory itself went away: check all its files and fall back to polling it
+                    touched.update(by_dir[directory])
+                    if mask & IN_IGNORED:
+                        del watches[wd]
+                        unwatched.add(directory)
+                    continue
+
+                path = os.path.join(directory, name)
+                if path in order:
+                    touched.add(path)
+
+            now = time.monotonic()
+            if overflow or now >= next_safety_scan:
+                if overflow:
+                    logger.warning("inotify queue overflowed, running a full scan.")
+                scan(order)
+                next_safety_scan = now + SAFETY_SCAN_INTERVAL
+                continue
+
+            if unwatched and now >= next_fallback_scan:
+                #retry watching (the directory may have been recreated) and poll what is still unwatched
+                for directory in list(unwatched):
+                    watch(directory)
+                for directory in unwatched:
+                    touched.update(by_dir[directory])
+                next_fallback_scan = now + FALLBACK_SCAN_INTERVAL
+
+            if touched:
+                scan(touched)
+    finally:
+        inotify.close()